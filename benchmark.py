@@ -0,0 +1,380 @@
+"""Нагрузочный прогон бота без Telegram
+
+Синтетические обновления с нажатиями кнопок проходят, как в боте, через
+update_processor настоящего Application (CONCURRENT_UPDATES) и
+handle_game_action, а бот-заглушка только запоминает правки сообщений.
+Запросы к API заглушки уступают цикл событий (--rtt - время ответа
+Telegram, по умолчанию DEFAULT_RTT), а игрок жмёт кнопки, не дожидаясь
+экрана, поэтому очереди нажатий, объединение кадров (actions_per_frame)
+и ожидание блокировки мира работают как под настоящей нагрузкой. Миры и файлы сохранения живут во временной папке.
+
+    python benchmark.py                        # все сценарии, 1/100/1000 игроков
+    python benchmark.py walk pvp --players 100 --actions 50 --rtt 0
+    python benchmark.py startup --players 1000   # запуск на сохранении 1000 игроков
+    python benchmark.py --json new.json --baseline old.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from telegram import Bot, Update, User
+from telegram.ext import Application, CallbackQueryHandler
+
+from config import AIR_HEIGHT, CONCURRENT_UPDATES
+from game_handlers import handle_game_action, LocalGame
+from multiplayer import MultiplayerManager
+from outbox import EditScheduler
+from stats import stats
+from world_generator import column_decoration
+
+MOVES = ["move_up", "move_down", "move_left", "move_right"]
+BREAKS = ["break_up", "break_down", "break_left", "break_right"]
+PLACES = ["place_stone", "place_dirt", "place_wood"]
+
+
+class StubBot(Bot):
+    """Бот без сети: запоминает правки сообщений вместо запросов к API
+
+    Ответ на запрос приходит через rtt секунд; и при 0 запрос уступает
+    цикл событий, как настоящий сетевой вызов.
+    """
+
+    def __init__(self, rtt=0.0):
+        super().__init__("1:benchmark")
+        with self._unfrozen():
+            self.rtt = rtt
+            self.edits = 0
+            self.edit_bytes = 0
+
+    async def get_me(self, *args, **kwargs):
+        with self._unfrozen():
+            self._bot_user = User(1, "benchmark", True, username="benchmark_bot")
+        return self._bot_user
+
+    async def answer_callback_query(self, callback_query_id, *args, **kwargs):
+        await asyncio.sleep(self.rtt)
+        return True
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, *args, **kwargs):
+        await asyncio.sleep(self.rtt)
+        with self._unfrozen():
+            self.edits += 1
+            self.edit_bytes += len(text.encode('utf-8'))
+        return True
+
+
+def make_update(bot, update_id, user_id, action):
+    """Обновление с нажатием кнопки, как его присылает Telegram"""
+    return Update.de_json({
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": "P", "username": f"p{user_id}"},
+            "chat_instance": str(user_id),
+            "data": action,
+            "message": {"message_id": 1, "date": 0, "chat": {"id": user_id, "type": "private"}}
+        }
+    }, bot)
+
+
+# Сценарии: prepare(world, rng, players) готовит мир, action(rng, step) - следующее нажатие
+
+def walk_action(rng, step):
+    return rng.choice(MOVES)
+
+def mining_action(rng, step):
+    # Очереди ударов киркой с редкими шагами вниз
+    if step % 8 == 7:
+        return "level_down"
+    return rng.choice(BREAKS)
+
+def pvp_prepare(world, rng, players):
+    # Все в тесной толпе у спавна, удары попадают в соседей
+    for user_id in players:
+        world.set_player_position(user_id, rng.randint(-3, 3), rng.randint(-3, 3), AIR_HEIGHT + 1)
+
+def pvp_action(rng, step):
+    return rng.choice(BREAKS) if step % 4 else rng.choice(MOVES)
+
+def edits_prepare(world, rng, players, history=50000):
+    # Длинная история построек: глобальные и личные изменения вокруг спавна
+    for _ in range(history):
+        x, y = rng.randint(-60, 60), rng.randint(-60, 60)
+        z = AIR_HEIGHT + rng.randint(-3, 2)
+        owner = rng.choice(players) if rng.random() < 0.5 else None
+        world.set_block(x, y, z, rng.choice(["камень", "земля", "ствол"]), owner)
+    for user_id in players:
+        for item in ("камень", "земля", "ствол"):
+            world.players[user_id].add_to_inventory(item, 1000)
+
+def edits_action(rng, step):
+    return rng.choice(MOVES + BREAKS + PLACES)
+
+SCENARIOS = {
+    "walk": (None, walk_action),
+    "mining": (None, mining_action),
+    "pvp": (pvp_prepare, pvp_action),
+    "edits": (edits_prepare, edits_action)
+}
+
+
+# Отдельный сценарий: время запуска бота на готовом сохранении
+STARTUP = "startup"
+STARTUP_PLAYERS_PER_WORLD = 10
+STARTUP_EDITS_PER_PLAYER = 50
+DEFAULT_RTT = 50  # мс, порядок времени ответа Bot API
+
+
+def build_application(bot):
+    """Application как в main(): обновления параллельно, до CONCURRENT_UPDATES"""
+    application = (Application.builder().bot(bot).updater(None)
+                   .concurrent_updates(CONCURRENT_UPDATES).build())
+    application.add_handler(CallbackQueryHandler(handle_game_action))
+    return application
+
+
+async def send_update(application, update):
+    """Обработать обновление так же, как его обрабатывает run_polling/webhook"""
+    await application.update_processor.process_update(update, application.process_update(update))
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def peak_rss_mb():
+    """Пик памяти процесса (на Linux ru_maxrss в КБ, на macOS в байтах)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+async def run_scenario(name, player_count, actions_per_player, seed, real_limits, rtt=0.0):
+    """Прогнать сценарий, вернуть словарь результатов"""
+    prepare, next_action = SCENARIOS[name]
+    random.seed(seed)  # Точки спавна
+    rng = random.Random(seed)
+    column_decoration.cache_clear()
+
+    bot = StubBot(rtt)
+    application = build_application(bot)
+
+    multiplayer = MultiplayerManager()
+    game = LocalGame(multiplayer)
+    if real_limits:
+        outbox = EditScheduler()
+    else:
+        # Лимиты Telegram меряют не сервер, а ожидание
+        outbox = EditScheduler(chat_rate=1e9, chat_burst=1e9, global_rate=1e9)
+    application.bot_data["game"] = game
+    application.bot_data["outbox"] = outbox
+
+    await application.initialize()
+    game.start()
+
+    players = [str(user_id) for user_id in range(1, player_count + 1)]
+    for user_id in players:
+        await game.join(user_id, f"p{user_id}")
+    if prepare:
+        prepare(multiplayer.worlds["default"], rng, players)
+    multiplayer.save_worlds()
+    stats.reset()
+
+    latencies = []
+    update_ids = iter(range(1, 1 << 62))
+
+    async def press(update):
+        start = time.perf_counter()
+        await send_update(application, update)
+        latencies.append(time.perf_counter() - start)
+
+    async def play(user_id):
+        # Нажатия не ждут экрана предыдущего: пока оно в работе,
+        # следующие встают в очередь игрока
+        presses = []
+        for step in range(actions_per_player):
+            update = make_update(bot, next(update_ids), int(user_id), next_action(rng, step))
+            presses.append(asyncio.get_running_loop().create_task(press(update)))
+            await asyncio.sleep(0)
+        await asyncio.gather(*presses)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(play(user_id) for user_id in players))
+    # Дожидаемся отправки последних кадров
+    while outbox.workers:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+
+    game.close()
+    await application.shutdown()
+
+    latencies.sort()
+    counters = stats.snapshot()['counters']
+    total = player_count * actions_per_player
+    return {
+        "scenario": name,
+        "players": player_count,
+        "actions": total,
+        "actions_per_sec": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "frames": bot.edits,
+        "actions_per_frame": round(total / max(bot.edits, 1), 2),
+        "frame_bytes": bot.edit_bytes,
+        "bytes_persisted": counters.get("bytes_written", 0),
+        "peak_rss_mb": round(peak_rss_mb(), 1)
+    }
+
+
+def save_startup_data(player_count, seed):
+    """Сохранение для сценария startup: игроки по мирам, у каждого постройки"""
+    random.seed(seed)
+    rng = random.Random(seed)
+    multiplayer = MultiplayerManager()
+    multiplayer.load_worlds()
+
+    for index in range(player_count):
+        user_id = str(index + 1)
+        world, player = multiplayer.join_world(
+            user_id, f"p{user_id}", f"world{index // STARTUP_PLAYERS_PER_WORLD}")
+        px, py, _ = player.position
+        for _ in range(STARTUP_EDITS_PER_PLAYER):
+            x, y = px + rng.randint(-20, 20), py + rng.randint(-20, 20)
+            world.set_block(x, y, AIR_HEIGHT + rng.randint(-3, 2),
+                            rng.choice(["камень", "земля", "ствол"]),
+                            user_id if rng.random() < 0.5 else None)
+
+    multiplayer.close()
+
+
+async def run_startup(player_count, seed):
+    """Время от создания бота до run_polling и до первого ответа"""
+    save_startup_data(player_count, seed)
+    saved_bytes = sum(os.path.getsize(os.path.join(folder, filename))
+                      for folder, _, filenames in os.walk(".") for filename in filenames)
+    stats.reset()
+
+    # Как в main(): Application, игра, post_init
+    start = time.perf_counter()
+    bot = StubBot()
+    application = build_application(bot)
+    game = LocalGame(MultiplayerManager())
+    application.bot_data["game"] = game
+    application.bot_data["outbox"] = EditScheduler(chat_rate=1e9, chat_burst=1e9, global_rate=1e9)
+    await application.initialize()
+    game.start()
+    startup = time.perf_counter() - start
+
+    # Первое нажатие игрока из последнего мира: загрузка списка и активация мира
+    await send_update(application, make_update(bot, 1, player_count, "center"))
+    first_action = time.perf_counter() - start - startup
+
+    game.close()
+    await application.shutdown()
+
+    return {
+        "scenario": STARTUP,
+        "players": player_count,
+        "saved_bytes": saved_bytes,
+        "startup_ms": round(startup * 1000, 3),
+        "first_action_ms": round(first_action * 1000, 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1)
+    }
+
+
+SCENARIO_COLUMNS = ["scenario", "players", "actions", "actions_per_sec", "p50_ms", "p99_ms",
+                    "frames", "actions_per_frame", "bytes_persisted", "peak_rss_mb"]
+STARTUP_COLUMNS = ["scenario", "players", "saved_bytes", "startup_ms", "first_action_ms",
+                   "peak_rss_mb"]
+COMPARED = ("actions_per_sec", "p50_ms", "p99_ms", "bytes_persisted", "startup_ms",
+            "first_action_ms")
+
+
+def print_results(results, baseline=None):
+    previous = {(row["scenario"], row["players"]): row for row in baseline or []}
+
+    for columns in (SCENARIO_COLUMNS, STARTUP_COLUMNS):
+        rows = [row for row in results if (row["scenario"] == STARTUP) == (columns is STARTUP_COLUMNS)]
+        if not rows:
+            continue
+        print(" ".join(f"{column:>15}" for column in columns))
+
+        for row in rows:
+            print(" ".join(f"{row[column]:>15}" for column in columns))
+            old = previous.get((row["scenario"], row["players"]))
+            if old:
+                # Изменение относительно базового прогона
+                changes = []
+                for column in COMPARED:
+                    if old.get(column) and column in row:
+                        changes.append(f"{column} {(row[column] / old[column] - 1) * 100:+.1f}%")
+                print(" " * 16 + "vs baseline: " + ", ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота без Telegram")
+    parser.add_argument("scenarios", nargs="*",
+                        help="Сценарии: " + ", ".join(list(SCENARIOS) + [STARTUP]))
+    parser.add_argument("--players", default="1,100,1000", help="Числа игроков через запятую")
+    parser.add_argument("--actions", type=int, default=20, help="Нажатий на игрока")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--real-limits", action="store_true",
+                        help="Лимиты Telegram на правки как в боте")
+    parser.add_argument("--rtt", type=float, default=DEFAULT_RTT,
+                        help="Время ответа API Telegram у заглушки, мс (0 - без ожидания, "
+                             "кадры почти не объединяются)")
+    parser.add_argument("--json", help="Сохранить результаты в файл")
+    parser.add_argument("--baseline", help="Сравнить с сохранённым прогоном")
+    args = parser.parse_args()
+
+    scenarios = args.scenarios or list(SCENARIOS) + [STARTUP]
+    for name in scenarios:
+        if name not in SCENARIOS and name != STARTUP:
+            parser.error(f"Нет сценария {name}")
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    # Сохранения миров - во временной папке (items.json уже прочитан при импорте)
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="minebot-bench-")
+    os.chdir(workdir)
+
+    results = []
+    try:
+        for name in scenarios:
+            for player_count in map(int, args.players.split(",")):
+                if name == STARTUP:
+                    results.append(asyncio.run(run_startup(player_count, args.seed)))
+                else:
+                    results.append(asyncio.run(run_scenario(
+                        name, player_count, args.actions, args.seed, args.real_limits,
+                        args.rtt / 1000)))
+                # Следующий сценарий начинает с пустого мира
+                for filename in os.listdir(workdir):
+                    if os.path.isdir(filename):
+                        shutil.rmtree(filename)  # world_regions
+                    else:
+                        os.remove(filename)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_results(results, baseline)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
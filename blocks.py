@@ -0,0 +1,111 @@
+import json
+from config import ITEMS_FILE
+
+MAX_BLOCK_ID = 255  # ID хранятся в bytearray чанков
+EMPTY = 0  # Нет изменения, блок берётся из генератора
+AIR = "воздух"
+
+# Эмодзи для блоков, у которых в items.json нет "id"
+DEFAULT_EMOJIS = {
+    "воздух": "5463010113440717314",
+    "персонаж": "5283132635361587188",
+    "трава": "5458430926683905591",
+    "земля": "5458822138075028493",
+    "камень": "5458781211331665562",
+    "уголь": "5456408804541340493",
+    "железная руда": "5458833133191306560",
+    "золотая руда": "5458617543012918174",
+    "алмазная руда": "5458420940884942467",
+    "ствол": "5458603588664171474",
+    "листва": "5462961855188180190",
+    "гриб поганка": "5458555278872026193",
+    "снег земля": "5458375770713890099"
+}
+
+
+class BlockRegistry:
+    """Палитра блоков: целочисленные ID <-> названия из items.json
+
+    ID 0 зарезервирован под «нет изменения». Блоки, которых нет в
+    items.json (например, из старых сохранений), получают ID при первом
+    обращении.
+
+    Свойства блоков - плоские списки по ID, чтобы горячий путь обходился
+    индексом вместо поиска по названию:
+    is_solid - можно стоять (прочность больше нуля),
+    is_minable - ломается ("добывается"),
+    drop_id - что выпадает ("дроп", по умолчанию сам блок),
+    hardness - прочность,
+    emoji_html - HTML клетки вида (set_emojis).
+    """
+
+    def __init__(self, items_data):
+        self.items_data = items_data
+        self.names = [None]  # id: название
+        self.ids = {}  # название: id
+
+        self.is_solid = [False]
+        self.is_minable = [False]
+        self.drop_id = [EMPTY]
+        self.hardness = [0]
+        # Эмодзи из items.json, недостающие - из DEFAULT_EMOJIS
+        self.emojis = dict(DEFAULT_EMOJIS)
+        self.emojis.update({name: data["id"]
+                            for section in ("блоки", "сущности")
+                            for name, data in items_data.get(section, {}).items() if "id" in data})
+        self.emoji_html = [self._emoji_html(None)]
+
+        for name in items_data.get("блоки", {}):
+            self.id_of(name)
+        # Сущности (персонаж) тоже рисуются в клетках вида
+        for name in items_data.get("сущности", {}):
+            self.id_of(name)
+        self.air = self.id_of(AIR)
+
+    def id_of(self, name):
+        """ID блока по названию"""
+        block_id = self.ids.get(name)
+        if block_id is None:
+            block_id = len(self.names)
+            if block_id > MAX_BLOCK_ID:
+                raise ValueError(f"Слишком много типов блоков: {name}")
+            self.names.append(name)
+            self.ids[name] = block_id
+
+            data = self.items_data.get("блоки", {}).get(name, {})
+            self.is_solid.append(data.get("прочность", 0) > 0)
+            self.is_minable.append(bool(data.get("добывается", False)))
+            self.hardness.append(data.get("прочность", 0))
+            self.drop_id.append(block_id)
+            self.emoji_html.append(self._emoji_html(name))
+            if data.get("дроп", name) != name:
+                self.drop_id[block_id] = self.id_of(data["дроп"])
+        return block_id
+
+    def _emoji_html(self, name):
+        # Блок без эмодзи рисуется воздухом
+        emoji_id = self.emojis.get(name) or self.emojis.get(AIR, "")
+        if emoji_id:
+            return f'<tg-emoji emoji-id="{emoji_id}">⬜</tg-emoji>'
+        return "⬜"
+
+    def set_emojis(self, emojis):
+        """Заменить эмодзи блоков ({название: emoji-id}) и пересобрать emoji_html"""
+        self.emojis = emojis
+        self.emoji_html[:] = [self._emoji_html(name) for name in self.names]
+
+    def name_of(self, block_id):
+        """Название блока по ID"""
+        return self.names[block_id]
+
+
+_registry = None
+
+
+def get_registry():
+    """Общая палитра, загружается из ITEMS_FILE один раз"""
+    global _registry
+    if _registry is None:
+        with open(ITEMS_FILE, 'r', encoding='utf-8') as f:
+            _registry = BlockRegistry(json.load(f))
+    return _registry
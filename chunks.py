@@ -0,0 +1,158 @@
+from config import CHUNK_SIZE
+from blocks import EMPTY, get_registry
+
+# Чанк - куб CHUNK_SIZE³; высота мира не ограничена, поэтому по Z
+# он тоже делится на секции
+assert CHUNK_SIZE & (CHUNK_SIZE - 1) == 0, "CHUNK_SIZE должен быть степенью двойки"
+SHIFT = CHUNK_SIZE.bit_length() - 1
+MASK = CHUNK_SIZE - 1
+CHUNK_VOLUME = CHUNK_SIZE ** 3
+EMPTY_BYTE = bytes((EMPTY,))
+
+
+def parse_key(key):
+    """'x,y,z' -> (x, y, z)"""
+    x, y, z = key.split(',')
+    return int(x), int(y), int(z)
+
+
+def changed_indexes(chunk):
+    """Индексы изменённых блоков чанка по возрастанию
+
+    Ищем каждый встречающийся ID через find (в C), а не перебираем
+    все CHUNK_VOLUME байт в Python - изменённых блоков обычно мало.
+    """
+    indexes = []
+    for block_id in set(chunk.translate(None, EMPTY_BYTE)):
+        needle = bytes((block_id,))
+        index = chunk.find(needle)
+        while index != -1:
+            indexes.append(index)
+            index = chunk.find(needle, index + 1)
+    indexes.sort()
+    return indexes
+
+
+class ChunkStore:
+    """Изменённые блоки по чанкам
+
+    Каждый чанк - bytearray из CHUNK_VOLUME ID палитры (blocks.py),
+    EMPTY означает «без изменений». Поиск блока - один словарь и
+    индекс в массиве, без строковых ключей.
+    """
+
+    def __init__(self):
+        self.chunks = {}  # (chunk_x, chunk_y, chunk_z): bytearray
+        self.counts = {}  # (chunk_x, chunk_y, chunk_z): число изменённых блоков
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def chunk_at(self, chunk_key):
+        """Массив чанка или None"""
+        return self.chunks.get(chunk_key)
+
+    def get(self, x, y, z):
+        """ID изменённого блока или EMPTY"""
+        chunk = self.chunks.get((x >> SHIFT, y >> SHIFT, z >> SHIFT))
+        if chunk is None:
+            return EMPTY
+        return chunk[(z & MASK) << (2 * SHIFT) | (y & MASK) << SHIFT | (x & MASK)]
+
+    def set(self, x, y, z, block_id):
+        """Запомнить изменённый блок"""
+        chunk_key = (x >> SHIFT, y >> SHIFT, z >> SHIFT)
+        chunk = self.chunks.get(chunk_key)
+        if chunk is None:
+            chunk = self.chunks[chunk_key] = bytearray(CHUNK_VOLUME)
+            self.counts[chunk_key] = 0
+
+        index = (z & MASK) << (2 * SHIFT) | (y & MASK) << SHIFT | (x & MASK)
+        if chunk[index] == EMPTY:
+            self.counts[chunk_key] += 1
+        chunk[index] = block_id
+
+    def remove(self, x, y, z):
+        """Забыть изменение. True, если оно было"""
+        chunk_key = (x >> SHIFT, y >> SHIFT, z >> SHIFT)
+        chunk = self.chunks.get(chunk_key)
+        if chunk is None:
+            return False
+
+        index = (z & MASK) << (2 * SHIFT) | (y & MASK) << SHIFT | (x & MASK)
+        if chunk[index] == EMPTY:
+            return False
+
+        chunk[index] = EMPTY
+        self.counts[chunk_key] -= 1
+        if not self.counts[chunk_key]:
+            del self.chunks[chunk_key]
+            del self.counts[chunk_key]
+        return True
+
+    def overlay(self, grid, x0, y0, z):
+        """Наложить изменения на срез grid высоты z (строки по y от y0, столбцы по x от x0)"""
+        if not self.chunks:
+            return
+
+        height, width = len(grid), len(grid[0])
+        chunk_z = z >> SHIFT
+        z_offset = (z & MASK) << (2 * SHIFT)
+
+        for chunk_y in range(y0 >> SHIFT, ((y0 + height - 1) >> SHIFT) + 1):
+            for chunk_x in range(x0 >> SHIFT, ((x0 + width - 1) >> SHIFT) + 1):
+                chunk = self.chunk_at((chunk_x, chunk_y, chunk_z))
+                if chunk is None:
+                    continue
+
+                # Пересечение чанка со срезом
+                x_start = max(x0, chunk_x << SHIFT)
+                x_end = min(x0 + width, (chunk_x + 1) << SHIFT)
+                for y in range(max(y0, chunk_y << SHIFT), min(y0 + height, (chunk_y + 1) << SHIFT)):
+                    start = z_offset | (y & MASK) << SHIFT | (x_start & MASK)
+                    segment = chunk[start:start + x_end - x_start]
+                    if not any(segment):
+                        continue
+
+                    row = grid[y - y0]
+                    for i, block_id in enumerate(segment):
+                        if block_id != EMPTY:
+                            row[x_start - x0 + i] = block_id
+
+    def all_chunks(self):
+        """Все непустые чанки: (ключ, массив, число изменённых блоков)"""
+        return [(key, chunk, self.counts[key]) for key, chunk in self.chunks.items()]
+
+    def items(self):
+        """Все изменения: (x, y, z, block_id)"""
+        for (cx, cy, cz), chunk, _ in self.all_chunks():
+            base_x, base_y, base_z = cx << SHIFT, cy << SHIFT, cz << SHIFT
+            chunk = bytes(chunk)
+            for index in changed_indexes(chunk):
+                yield (base_x + (index & MASK),
+                       base_y + (index >> SHIFT & MASK),
+                       base_z + (index >> (2 * SHIFT)),
+                       chunk[index])
+
+    def to_dict(self):
+        """Сохранить как {"x,y,z": название} (формат world_data.json)"""
+        names = get_registry().names
+        return {f"{x},{y},{z}": names[block_id] for x, y, z, block_id in self.items()}
+
+    def copy(self):
+        """Независимая копия"""
+        store = ChunkStore()
+        store.chunks = {key: bytearray(chunk) for key, chunk in self.chunks.items()}
+        store.counts = dict(self.counts)
+        return store
+
+    @classmethod
+    def from_dict(cls, data):
+        """Загрузить из {"x,y,z": название} или скопировать ChunkStore (снимок snapshot.py)"""
+        if isinstance(data, ChunkStore):
+            return data.copy()
+        registry = get_registry()
+        store = cls()
+        for key, name in data.items():
+            store.set(*parse_key(key), registry.id_of(name))
+        return store
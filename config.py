@@ -6,15 +6,61 @@ VIEW_SIZE = 9  # 11x11 вид
 AIR_HEIGHT = 20  # Высота воздушного слоя
 GRASS_HEIGHT = 5  # Высота слоя земли
 WORLD_SEED = 12345  # Сид мира
+CHUNK_SIZE = 16  # Сторона чанка в блоках
+DECORATION_CACHE_SIZE = 4096  # Столбцов с деревьями/грибами в LRU-кэше (0 - без кэша)
+TERRAIN_CACHE_SIZE = 1024  # Плиток генерации CHUNK_SIZE×CHUNK_SIZE в LRU-кэше
 
 # Пути к файлам
 ITEMS_FILE = "items.json"
-WORLD_FILE = "world_data.json"
+WORLD_FILE = "world_data.json"  # Старый снимок в JSON (читается, если нет SNAPSHOT_FILE)
+SNAPSHOT_FILE = "world_data.mbs"  # Снимок миров в двоичном формате (snapshot.py)
+JOURNAL_FILE = "world_journal.jsonl"
+SHARD_MARKER = "world_data.shards"  # Число шардов, по которым разложены снимки (persistence.reshard)
+SQLITE_FILE = "world_data.db"
 EMOJI_FILE = "emoji_data.txt"
 
+# Отрисовка
+ROW_CACHE_SIZE = 4096  # Отрисованных строк вида в LRU-кэше
+FRAME_CACHE_SIZE = 10000  # Последних кадров игроков в LRU-кэше
+
+# Сохранение
+STORAGE_BACKEND = "journal"  # "journal" (снимок + журнал) или "sqlite"
+SAVE_INTERVAL = 5  # Секунд между фоновыми записями на диск
+JOURNAL_COMPACT_SIZE = 4 * 1024 * 1024  # Размер журнала для сжатия в снимок
+# Глобальные изменения в файлах регионов (mmap) вместо снимка - для миров
+# с миллионами изменённых блоков. Переведённые миры остаются в регионах
+REGION_FILES = False
+REGION_DIR = "world_regions"  # Каталог файлов регионов, внутри - по каталогу на мир
+REGION_SIZE = 32  # Сторона региона в чанках (степень двойки)
+
 # Мультиплеер
 PLAYER_SPAWN_RADIUS = 20  # Радиус спавна игроков
 MAX_PLAYERS_PER_WORLD = 100
+PLAYER_IDLE_TIMEOUT = 600  # Секунд без действий, после которых игрок выгружается из памяти
+PLAYER_EVICT_INTERVAL = 60  # Секунд между проверками неактивных игроков
+CONCURRENT_UPDATES = 64  # Сколько обновлений Telegram обрабатывать одновременно
+SHARD_COUNT = 1  # Процессов с мирами; 1 - все миры в процессе бота
+SHARD_REPLICAS = 64  # Точек шарда на кольце консистентного хеширования
+
+# Лимиты Telegram на отправку
+CHAT_EDIT_RATE = 1.0  # Правок в секунду на чат
+CHAT_EDIT_BURST = 3  # Правок подряд без ожидания
+GLOBAL_SEND_RATE = 30  # Сообщений в секунду на весь бот
+
+# Приём обновлений
+UPDATE_MODE = "polling"  # "polling" или "webhook" (нужен aiohttp)
+WEBHOOK_URL = ""  # Публичный https-адрес прокси; пусто - setWebhook не вызывается
+WEBHOOK_HOST = "127.0.0.1"  # TLS снимает локальный прокси
+WEBHOOK_PORT = 8080
+WEBHOOK_PATH = "/telegram"
+WEBHOOK_SECRET = ""  # secret_token, который Telegram присылает в заголовке
+WEBHOOK_MAX_PENDING = 256  # Обновлений в работе, сверх этого - ответ 503
+
+# Статистика
+ADMIN_IDS = []  # user_id администраторов (команда /stats)
+STATS_FILE = ""  # Файл метрик в формате Prometheus, пусто - не писать
+STATS_PORT = 0  # Порт HTTP /metrics на 127.0.0.1 (нужен aiohttp), 0 - не слушать
+STATS_INTERVAL = 15  # Секунд между записями STATS_FILE
 
 # Игрок
 MAX_HEALTH = 10  # 10 сердечек
@@ -1,114 +1,56 @@
+import html
 import logging
+import time
 from telegram import Update
 from telegram.ext import ContextTypes
-import json
 
-from config import VIEW_SIZE, AIR_HEIGHT
-from keyboard import create_game_keyboard
-from multiplayer import MultiplayerManager
+from config import VIEW_SIZE, AIR_HEIGHT, ADMIN_IDS
+from keyboard import create_game_keyboard, placeable_items
+from blocks import get_registry
+from render import ViewRenderer
+from stats import stats, format_text
+from world_generator import column_decoration
 
 logger = logging.getLogger(__name__)
 
-# Загружаем эмодзи
-def load_emojis():
-    try:
-        with open("items.json", 'r', encoding='utf-8') as f:
-            items = json.load(f)
-        
-        emojis = {}
-        
-        # Загружаем блоки
-        if "блоки" in items:
-            for block_name, block_data in items["блоки"].items():
-                if "id" in block_data:
-                    emojis[block_name] = block_data["id"]
-        
-        # Загружаем сущности (если есть)
-        if "сущности" in items:
-            for entity_name, entity_data in items["сущности"].items():
-                if "id" in entity_data:
-                    emojis[entity_name] = entity_data["id"]
-        
-        # Дефолтные значения если нет в файле
-        if "воздух" not in emojis:
-            emojis["воздух"] = "5463010113440717314"
-        if "персонаж" not in emojis:
-            emojis["персонаж"] = "5283132635361587188"
-        
-        # Добавляем остальные дефолтные
-        default_emojis = {
-            "трава": "5458430926683905591",
-            "земля": "5458822138075028493",
-            "камень": "5458781211331665562",
-            "уголь": "5456408804541340493",
-            "железная руда": "5458833133191306560",
-            "золотая руда": "5458617543012918174",
-            "алмазная руда": "5458420940884942467",
-            "ствол": "5458603588664171474",
-            "листва": "5462961855188180190",
-            "гриб поганка": "5458555278872026193",
-            "снег земля": "5458375770713890099"
-        }
-        
-        for name, emoji_id in default_emojis.items():
-            if name not in emojis:
-                emojis[name] = emoji_id
-        
-        return emojis
-    except Exception as e:
-        logger.error(f"Ошибка загрузки эмодзи: {e}")
-        # Возвращаем дефолтные
-        return {
-            "воздух": "5463010113440717314",
-            "персонаж": "5283132635361587188",
-            "трава": "5458430926683905591",
-            "земля": "5458822138075028493",
-            "камень": "5458781211331665562",
-            "уголь": "5456408804541340493",
-            "железная руда": "5458833133191306560",
-            "золотая руда": "5458617543012918174",
-            "алмазная руда": "5458420940884942467",
-            "ствол": "5458603588664171474",
-            "листва": "5462961855188180190",
-            "гриб поганка": "5458555278872026193",
-            "снег земля": "5458375770713890099"
-        }
+# Эмодзи клеток берутся из BlockRegistry (items.json и blocks.DEFAULT_EMOJIS)
+renderer = ViewRenderer()
 
-EMOJIS = load_emojis()
-multiplayer = MultiplayerManager()
+def get_game(context):
+    """Игра приложения: LocalGame или ShardRouter (см. main.py)"""
+    return context.bot_data["game"]
 
-def format_view(view):
-    """Форматировать вид"""
-    result = ""
-    for row in view:
-        for block in row:
-            emoji_id = EMOJIS.get(block)
-            if not emoji_id:
-                # Если не нашли, используем воздух
-                emoji_id = EMOJIS.get("воздух", "")
-            
-            if emoji_id:
-                result += f'<tg-emoji emoji-id="{emoji_id}">⬜</tg-emoji>'
-            else:
-                result += "⬜"
-        result += "\n"
-    return result
+def get_outbox(context):
+    """Общий EditScheduler приложения (см. main.py)"""
+    return context.bot_data["outbox"]
 
-async def show_game_world(update: Update, context: ContextTypes.DEFAULT_TYPE, 
-                         player_id, message=""):
-    """Показать игровой мир"""
-    world = multiplayer.get_player_world(player_id)
-    if not world:
-        await update.message.reply_text("❌ Вы не в мире!\n/join чтобы присоединиться")
-        return
+# Нажатия, ждущие применения: user_id: список действий
+action_queues = {}
+
+def queue_action(user_id, action):
+    """Поставить действие игрока в очередь
     
-    player = world.get_player(player_id)
-    if not player:
-        await update.message.reply_text("❌ Игрок не найден")
-        return
+    Возвращает очередь, если её нужно обработать вызывающему, или None,
+    если действие подхватит уже идущая обработка этого игрока.
+    """
+    queue = action_queues.get(user_id)
+    if queue is not None:
+        queue.append(action)
+        return None
     
-    view = world.get_view(player_id)
-    view_text = format_view(view)
+    queue = action_queues[user_id] = [action]
+    return queue
+
+def format_view(view, player_id=None):
+    """Форматировать вид (строки ID блоков из GameWorld.get_view)"""
+    return renderer.render(view, player_id)
+
+def format_game_screen(world, player, message=""):
+    """Текст игрового экрана игрока"""
+    with stats.timer("get_view"):
+        view = world.get_view(player.user_id)
+    with stats.timer("format_view"):
+        view_text = format_view(view, player.user_id)
     
     px, py, pz = player.position
     grass_level = AIR_HEIGHT
@@ -127,40 +69,32 @@ async def show_game_world(update: Update, context: ContextTypes.DEFAULT_TYPE,
             f"📍 X:{px} Y:{py} Z:{pz}\n"
             f"🌿 Трава: Z={grass_level}\n"
             f"{depth_text}\n"
-            f"📦 Предметов: {sum(player.inventory.values())}\n"
+            f"📦 Предметов: {player.inventory_size()}\n"
             f"👥 Онлайн: {len(world.players) - 1}\n"
             f"💬 {message}")
     
-    if update.callback_query:
-        await update.callback_query.edit_message_text(
-            f"{view_text}\n{info}",
-            parse_mode="HTML",
-            reply_markup=create_game_keyboard()
-        )
-    else:
-        await update.message.reply_text(
-            f"{view_text}\n{info}",
-            parse_mode="HTML",
-            reply_markup=create_game_keyboard()
-        )
+    return f"{view_text}\n{info}"
 
-async def handle_game_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик игровых действий - ИСПРАВЛЕННАЯ ВЕРСИЯ"""
+async def send_game_screen(update: Update, context: ContextTypes.DEFAULT_TYPE, text, reply_markup):
+    """Отправить игровой экран (правкой сообщения с кнопками или новым)"""
     query = update.callback_query
-    await query.answer()
-    
-    user_id = str(update.effective_user.id)
-    username = update.effective_user.username or "Игрок"
-    action = query.data
-    
-    # Получаем мир и игрока
-    world = multiplayer.get_player_world(user_id)
-    if not world:
-        # Автоприсоединение к дефолтному миру
-        world, player = multiplayer.join_world(user_id, username)
+    if query:
+        async def edit(text, reply_markup):
+            await query.edit_message_text(text, parse_mode="HTML", reply_markup=reply_markup)
+        
+        # Правки идут через очередь: частые нажатия сливаются в один кадр
+        get_outbox(context).submit(query.message.chat_id, query.message.message_id,
+                                   text, reply_markup, edit)
     else:
-        player = world.get_player(user_id)
-    
+        with stats.timer("telegram_reply"):
+            await update.message.reply_text(
+                text,
+                parse_mode="HTML",
+                reply_markup=reply_markup
+            )
+
+def apply_action(multiplayer, world, player, user_id, action):
+    """Применить игровое действие к миру, вернуть сообщение для игрока"""
     message = ""
     
     # ДВИЖЕНИЕ
@@ -227,23 +161,17 @@ async def handle_game_action(update: Update, context: ContextTypes.DEFAULT_TYPE)
             if dropped_item:
                 message = f"⛏️ {dropped_item}"
             else:
-                # Проверяем, что за блок
-                block = world.get_block(target_x, target_y, pz, user_id)
-                if block == "воздух":
+                # Проверяем, что за блок (по таблицам палитры)
+                registry = get_registry()
+                block_id = world.get_block_id(target_x, target_y, pz, user_id)
+                block = registry.names[block_id]
+                if block_id == registry.air:
                     message = "💨 Воздух"
                 else:
-                    # Проверяем данные блока
-                    try:
-                        with open("items.json", 'r', encoding='utf-8') as f:
-                            items_data = json.load(f)
-                        
-                        block_data = items_data.get("блоки", {}).get(block, {})
-                        if not block_data.get("добывается", False):
-                            message = f"❌ Нельзя сломать {block}"
-                        else:
-                            message = f"❌ Ошибка добычи {block}"
-                    except:
-                        message = f"❌ Ошибка с {block}"
+                    if not registry.is_minable[block_id]:
+                        message = f"❌ Нельзя сломать {block}"
+                    else:
+                        message = f"❌ Ошибка добычи {block}"
     
     # РАЗМЕЩЕНИЕ БЛОКОВ
     elif action == "place_stone":
@@ -297,7 +225,7 @@ async def handle_game_action(update: Update, context: ContextTypes.DEFAULT_TYPE)
     elif action == "inventory":
         if player.inventory:
             items = []
-            for item, count in player.inventory.items():
+            for item, count in player.inventory_items().items():
                 if count > 0:
                     items.append(f"{item}: {count}")
             
@@ -326,39 +254,198 @@ async def handle_game_action(update: Update, context: ContextTypes.DEFAULT_TYPE)
     elif action == "home":
         # Телепорт на спавн (0, 0, AIR_HEIGHT + 1)
         from config import AIR_HEIGHT
-        player.position = [0, 0, AIR_HEIGHT + 1]
+        world.set_player_position(user_id, 0, 0, AIR_HEIGHT + 1)
         message = "🏠 Телепорт домой!"
     
-    # Сохраняем и показываем
-    multiplayer.save_worlds()
-    await show_game_world(update, context, user_id, message)
+    return message
 
-# Добавим обработчик команды /debug для тестирования
-async def debug_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Команда для отладки"""
-    user_id = str(update.effective_user.id)
+# Игровые операции над MultiplayerManager. Их вызывает LocalGame в процессе
+# бота или процесс-шард (shards.py), поэтому они принимают и возвращают
+# только простые данные: экран - это (текст, предметы для кнопок размещения).
+
+async def play_actions(multiplayer, user_id, username, queue):
+    """Применить действия из очереди игрока и отрисовать один экран"""
+    messages = []
+    while True:
+        # Чтение с диска (если оно нужно) - до блокировки и вне цикла
+        # событий, с запасом на все шаги пачки
+        world = await multiplayer.activate_player(user_id, reach=len(queue))
+        
+        # Мир меняется только под его блокировкой и без await внутри, поэтому
+        # при concurrent_updates действия одного мира применяются по порядку,
+        # а разные миры обрабатываются параллельно
+        async with multiplayer.world_lock(world.world_id if world else "default"):
+            if not world:
+                # Автоприсоединение к дефолтному миру; activate_player уже
+                # выяснил, что в хранилище игрока нет
+                world, player = multiplayer.join_world(user_id, username, saved=False)
+            else:
+                player = world.get_player(user_id)
+            player.last_active = time.monotonic()
+            
+            # Действия, добавленные в очередь до этого момента, применяются
+            # одним шагом с одной отрисовкой. Если игрок ушёл (или
+            # телепортировался) за подгруженные чанки, сначала подгружаем их
+            while queue and world.chunks_ready(*player.position[:2], VIEW_SIZE // 2 + 1):
+                action = queue.pop(0)
+                with stats.timer("action_" + action.split("_")[0]):
+                    message = apply_action(multiplayer, world, player, user_id, action)
+                if message and (not messages or messages[-1] != message):
+                    messages.append(message)
+            
+            if queue or not world.chunks_ready(*player.position[:2], VIEW_SIZE // 2):
+                continue
+            
+            # Изменения уже помечены, на диск их запишет фоновый WorldSaver
+            return format_game_screen(world, player, " ".join(messages)), placeable_items(player)
+
+async def render_screen(multiplayer, user_id, message=""):
+    """Экран игрока; None - игрок не в мире, (ошибка, None) - игрок не найден"""
+    world = await multiplayer.activate_player(user_id)
+    if not world:
+        return None
     
-    world = multiplayer.get_player_world(user_id)
+    async with multiplayer.world_lock(world.world_id):
+        player = world.get_player(user_id)
+        if not player:
+            return "❌ Игрок не найден", None
+        player.last_active = time.monotonic()
+        return format_game_screen(world, player, message), placeable_items(player)
+
+async def join_player(multiplayer, user_id, username, world_id="default"):
+    """Добавить игрока в мир"""
+    # Сохранённый игрок подгружается заранее, вне цикла событий; если
+    # его нигде нет, в хранилище его и не ищем
+    world = await multiplayer.activate_player(user_id)
+    async with multiplayer.world_lock(world_id):
+        multiplayer.join_world(user_id, username, world_id, saved=world is not None)
+
+async def debug_info(multiplayer, user_id):
+    """Текст /debug"""
+    world = await multiplayer.activate_player(user_id)
     if not world:
-        await update.message.reply_text("❌ Нет мира")
-        return
+        return "❌ Нет мира"
     
     player = world.get_player(user_id)
     if not player:
-        await update.message.reply_text("❌ Нет игрока")
-        return
+        return "❌ Нет игрока"
     
     # Информация о блоке под ногами
     px, py, pz = player.position
     block_below = world.get_block(px, py, pz - 1, user_id)
     block_at = world.get_block(px, py, pz, user_id)
     
-    info = (f"🔧 Отладка:\n"
+    return (f"🔧 Отладка:\n"
             f"Позиция: {px}, {py}, {pz}\n"
             f"Блок в позиции: {block_at}\n"
             f"Блок под ногами: {block_below}\n"
             f"Можно двигаться? {world.can_move_to(px, py, pz, user_id)}\n"
-            f"Инвентарь: {player.inventory}\n"
+            f"Инвентарь: {player.inventory_items()}\n"
             f"Здоровье: {player.health}")
+
+def world_stats(multiplayer):
+    """Мгновенные значения миров процесса для статистики"""
+    gauges = {
+        'worlds': len(multiplayer.worlds),
+        'worlds_dormant': len(multiplayer.dormant_worlds),
+        'players_loaded': sum(len(world.players) for world in multiplayer.worlds.values()),
+        'players_offline': sum(len(world.offline_players) for world in multiplayer.worlds.values())
+    }
+    for name, value in multiplayer.generator.cache_stats().items():
+        gauges[f"terrain_cache_{name}"] = value
+    for name, value in renderer.cache_stats().items():
+        gauges[f"render_{name}"] = value
+    decoration = column_decoration.cache_info()
+    gauges['decoration_cache_hits'] = decoration.hits
+    gauges['decoration_cache_misses'] = decoration.misses
+    return gauges
+
+async def collect_stats(multiplayer):
+    """Снимок статистики процесса вместе с мирами"""
+    return stats.snapshot(world_stats(multiplayer))
+
+class LocalGame:
+    """Все миры в процессе бота (SHARD_COUNT = 1)
+    
+    Тот же интерфейс, что у shards.ShardRouter.
+    """
+    
+    def __init__(self, multiplayer):
+        self.multiplayer = multiplayer
+    
+    def start(self):
+        self.multiplayer.start()
+    
+    def close(self):
+        self.multiplayer.close()
+    
+    async def play(self, user_id, username, queue):
+        return await play_actions(self.multiplayer, user_id, username, queue)
+    
+    async def show(self, user_id, message=""):
+        return await render_screen(self.multiplayer, user_id, message)
+    
+    async def join(self, user_id, username, world_id="default"):
+        await join_player(self.multiplayer, user_id, username, world_id)
+    
+    async def debug(self, user_id):
+        return await debug_info(self.multiplayer, user_id)
+    
+    async def stats(self):
+        return await collect_stats(self.multiplayer)
+
+async def show_game_world(update: Update, context: ContextTypes.DEFAULT_TYPE, 
+                         player_id, message="",
+                         not_in_world="❌ Вы не в мире!\n/join чтобы присоединиться"):
+    """Показать игровой мир"""
+    screen = await get_game(context).show(player_id, message)
+    if not screen:
+        await update.message.reply_text(not_in_world)
+        return
+    
+    text, placeable = screen
+    if placeable is None:
+        await update.message.reply_text(text)
+        return
+    
+    await send_game_screen(update, context, text, create_game_keyboard(placeable))
+
+async def handle_game_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик игровых действий - ИСПРАВЛЕННАЯ ВЕРСИЯ"""
+    query = update.callback_query
+    
+    user_id = str(update.effective_user.id)
+    username = update.effective_user.username or "Игрок"
+    action = query.data
+    
+    # Нажатия, пришедшие пока предыдущее ещё ждёт мир, копятся в очереди
+    # игрока и применяются одним шагом с одной отрисовкой. В очередь -
+    # до первого await: ответы на answer() приходят в любом порядке
+    queue = queue_action(user_id, action)
+    if queue is None:
+        await query.answer()
+        return
+    
+    try:
+        await query.answer()
+        with stats.timer("handle_action"):
+            text, placeable = await get_game(context).play(user_id, username, queue)
+    finally:
+        action_queues.pop(user_id, None)
+    
+    await send_game_screen(update, context, text, create_game_keyboard(placeable))
+
+# Добавим обработчик команды /debug для тестирования
+async def debug_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда для отладки"""
+    user_id = str(update.effective_user.id)
+    await update.message.reply_text(await get_game(context).debug(user_id))
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Статистика горячего пути (только для ADMIN_IDS)"""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
     
-    await update.message.reply_text(info)
+    snapshot = await get_game(context).stats()
+    text = format_text(snapshot)
+    await update.message.reply_text(f"<pre>{html.escape(text)}</pre>", parse_mode="HTML")
@@ -1,7 +1,44 @@
+from functools import lru_cache
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
-def create_game_keyboard():
-    """Основная игровая клавиатура"""
+# Кнопки размещения: (предмет в инвентаре, подпись, действие)
+PLACE_BUTTONS = (
+    ("камень", "🪨", "place_stone"),
+    ("земля", "🌿", "place_dirt"),
+    ("ствол", "🪵", "place_wood")
+)
+ALL_PLACEABLE = tuple(item for item, _, _ in PLACE_BUTTONS)
+
+class CachedKeyboardMarkup(InlineKeyboardMarkup):
+    """Неизменяемая клавиатура, которая сериализуется один раз
+    
+    Клавиатуры ниже создаются один раз и переиспользуются в каждом
+    сообщении, поэтому to_dict() (его вызывает PTB при каждой отправке)
+    возвращает готовый словарь. Его нельзя менять.
+    """
+    
+    __slots__ = ("_serialized",)
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        with self._unfrozen():
+            self._serialized = None
+    
+    def to_dict(self, recursive=True):
+        if not recursive:
+            return super().to_dict(recursive)
+        if self._serialized is None:
+            with self._unfrozen():
+                self._serialized = super().to_dict(recursive)
+        return self._serialized
+
+@lru_cache(maxsize=None)
+def create_game_keyboard(placeable=ALL_PLACEABLE):
+    """Основная игровая клавиатура
+    
+    placeable - предметы, для которых показывать кнопки размещения.
+    Вариантов немного, каждый собирается один раз.
+    """
     keyboard = [
         [
             InlineKeyboardButton("⛏️⬆️", callback_data="break_up"),
@@ -29,16 +66,21 @@ def create_game_keyboard():
             InlineKeyboardButton("🎒", callback_data="inventory"),
             InlineKeyboardButton("👥", callback_data="players"),
             InlineKeyboardButton("🏠", callback_data="home")
-        ],
-        [
-            InlineKeyboardButton("🪨", callback_data="place_stone"),
-            InlineKeyboardButton("🌿", callback_data="place_dirt"),
-            InlineKeyboardButton("🪵", callback_data="place_wood")
         ]
     ]
     
-    return InlineKeyboardMarkup(keyboard)
+    place_row = [InlineKeyboardButton(label, callback_data=action)
+                 for item, label, action in PLACE_BUTTONS if item in placeable]
+    if place_row:
+        keyboard.append(place_row)
+    
+    return CachedKeyboardMarkup(keyboard)
+
+def placeable_items(player):
+    """Предметы игрока, для которых нужны кнопки размещения (ключ варианта клавиатуры)"""
+    return tuple(item for item in ALL_PLACEABLE if player.has_inventory(item))
 
+@lru_cache(maxsize=None)
 def create_menu_keyboard():
     """Клавиатура меню"""
     keyboard = [
@@ -56,4 +98,4 @@ def create_menu_keyboard():
         ]
     ]
     
-    return InlineKeyboardMarkup(keyboard)
+    return CachedKeyboardMarkup(keyboard)
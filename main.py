@@ -2,10 +2,15 @@ import logging
 from telegram import Update
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
 
-from config import TOKEN
+from config import TOKEN, CONCURRENT_UPDATES, UPDATE_MODE, SHARD_COUNT
 from keyboard import create_menu_keyboard
-from game_handlers import handle_game_action, show_game_world
+from game_handlers import handle_game_action, show_game_world, get_game, stats_command, LocalGame
 from multiplayer import MultiplayerManager
+from outbox import EditScheduler
+from persistence import reshard
+from shards import ShardRouter
+from stats import stats, StatsExporter
+from webhook import run_webhook
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -13,8 +18,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-multiplayer = MultiplayerManager()
-
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /start"""
     await update.message.reply_text(
@@ -33,7 +36,7 @@ async def new_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
     username = update.effective_user.username or "Игрок"
     
-    world, player = multiplayer.join_world(user_id, username, "default")
+    await get_game(context).join(user_id, username, "default")
     
     await show_game_world(update, context, user_id, "🎮 Добро пожаловать!")
 
@@ -41,11 +44,8 @@ async def continue_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Продолжить игру"""
     user_id = str(update.effective_user.id)
     
-    world = multiplayer.get_player_world(user_id)
-    if world:
-        await show_game_world(update, context, user_id, "▶️ Продолжаем!")
-    else:
-        await update.message.reply_text("❌ Нет сохраненной игры\n/newgame - начать")
+    await show_game_world(update, context, user_id, "▶️ Продолжаем!",
+                          not_in_world="❌ Нет сохраненной игры\n/newgame - начать")
 
 async def join_world(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Присоединиться к миру"""
@@ -53,7 +53,7 @@ async def join_world(update: Update, context: ContextTypes.DEFAULT_TYPE):
     username = update.effective_user.username or "Игрок"
     
     # Можно добавить выбор мира, пока дефолтный
-    world, player = multiplayer.join_world(user_id, username, "default")
+    await get_game(context).join(user_id, username, "default")
     
     await show_game_world(update, context, user_id, "👥 Присоединились к миру!")
 
@@ -74,9 +74,40 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "• Все в одном мире"
     )
 
+async def post_init(application: Application):
+    """Фоновое сохранение (или процессы-шарды) живут в цикле событий бота"""
+    game = get_game(application)
+    game.start()
+    
+    exporter = application.bot_data["stats_exporter"] = StatsExporter(game.stats)
+    await exporter.start()
+
+async def post_shutdown(application: Application):
+    """Дописываем отложенные изменения перед выходом"""
+    await application.bot_data["stats_exporter"].close()
+    get_game(application).close()
+
 def main():
     """Запуск бота"""
-    application = Application.builder().token(TOKEN).build()
+    # Разные миры обрабатываются параллельно, один мир - по очереди (world_lock)
+    application = (
+        Application.builder()
+        .token(TOKEN)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+    
+    # Миры в процессе бота или в процессах-шардах, обработчикам всё равно.
+    # Если SHARD_COUNT поменялся, сохранённые миры переезжают к новым владельцам
+    reshard(SHARD_COUNT)
+    if SHARD_COUNT > 1:
+        application.bot_data["game"] = ShardRouter(SHARD_COUNT)
+    else:
+        application.bot_data["game"] = LocalGame(MultiplayerManager())
+    outbox = application.bot_data["outbox"] = EditScheduler()
+    stats.add_source("edits", outbox.counters)
     
     # Команды
     application.add_handler(CommandHandler("start", start))
@@ -84,15 +115,19 @@ def main():
     application.add_handler(CommandHandler("continue", continue_game))
     application.add_handler(CommandHandler("join", join_world))
     application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("stats", stats_command))
     
     # Обработчик игровых кнопок
     application.add_handler(CallbackQueryHandler(handle_game_action))
     
     logger.info("🎮 Мультиплеерный бот запущен!")
-    application.run_polling(
-        allowed_updates=Update.ALL_TYPES,
-        drop_pending_updates=True
-    )
+    if UPDATE_MODE == "webhook":
+        run_webhook(application)
+    else:
+        application.run_polling(
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=True
+        )
 
 if __name__ == '__main__':
     main()
@@ -1,63 +1,218 @@
-import json
+import asyncio
+import logging
 import random
-from config import WORLD_FILE, PLAYER_SPAWN_RADIUS
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import PLAYER_SPAWN_RADIUS, VIEW_SIZE, PLAYER_IDLE_TIMEOUT, PLAYER_EVICT_INTERVAL
 from world import GameWorld
+from world_generator import WorldGenerator
+from persistence import WorldSaver, create_storage
+from stats import stats
+
+logger = logging.getLogger(__name__)
 
 class MultiplayerManager:
-    def __init__(self):
-        self.worlds = {}  # world_id: GameWorld
+    """Все миры и игроки бота
+
+    Создаётся один раз: в процессе бота (game_handlers.LocalGame) или в
+    каждом процессе-шарде (shards.py). Шарду передаются своё хранилище и
+    owns_world - он загружает только миры, которые ему принадлежат.
+    """
+    
+    def __init__(self, storage=None, owns_world=None):
+        self.worlds = {}  # world_id: GameWorld (активированные миры)
+        self.dormant_worlds = {}  # world_id: данные из хранилища, мир ещё не создан
+        self.foreign_worlds = {}  # world_id: данные чужого мира (шард им не владеет)
         self.player_worlds = {}  # user_id: world_id
+        self.generator = WorldGenerator()  # Общий для всех миров
+        self.world_locks = {}  # world_id: asyncio.Lock
+        
+        # Хранилище при создании не читается: список миров загружается
+        # в потоке ввода-вывода при первом обращении (ensure_loaded),
+        # а каждый мир создаётся, только когда он кому-то нужен (get_world)
+        self.storage = storage or create_storage()
+        self.owns_world = owns_world
+        self._loaded = False
+        self._loading = None  # asyncio.Future чтения хранилища
+        
+        # Весь ввод-вывод после старта идёт в одном отдельном потоке
+        self.io_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="world-io")
         
-        self.load_worlds()
+        # Обработчики только помечают изменения, на диск их пишет WorldSaver
+        # (запускается в цикле событий через start())
+        self.saver = WorldSaver(self.worlds, self.storage, self.io_executor,
+                                dormant=self.dormant_worlds, foreign=self.foreign_worlds)
+        self._evict_task = None
     
     def load_worlds(self):
-        """Загрузить миры из файла"""
-        try:
-            with open(WORLD_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
+        """Загрузить список миров из хранилища сразу (без цикла событий)"""
+        if not self._loaded:
+            self._register_worlds(self.storage.load())
+    
+    async def ensure_loaded(self):
+        """Загрузить список миров, не блокируя цикл событий
+        
+        Чтение одно на всех: остальные обращения ждут его результата.
+        """
+        if self._loaded:
+            return
+        if self._loading is None:
+            loop = asyncio.get_running_loop()
+            self._loading = loop.run_in_executor(self.io_executor, self.storage.load)
+        data = await self._loading
+        if not self._loaded:
+            self._register_worlds(data)
+    
+    def _register_worlds(self, data):
+        """Запомнить миры хранилища по ID, не создавая их"""
+        with stats.timer("register_worlds"):
             for world_id, world_data in data.items():
-                world = GameWorld(world_id)
-                world.load_from_dict(world_data)
-                self.worlds[world_id] = world
+                if self.owns_world and not self.owns_world(world_id):
+                    # Переносит миры persistence.reshard; если файлы всё же
+                    # разложены не так, чужой мир сохраняется нетронутым
+                    self.foreign_worlds[world_id] = world_data
+                    continue
+                if world_id in self.worlds:
+                    continue
+                self.dormant_worlds[world_id] = world_data
                 
-                # Восстанавливаем привязки игроков
-                for player_id in world.players.keys():
-                    self.player_worlds[player_id] = world_id
-                    
-        except FileNotFoundError:
-            self.worlds = {}
-            self.player_worlds = {}
+                # Привязки игроков (ленивое хранилище находит их само)
+                for player_id in world_data.get('players', ()):
+                    self.player_worlds.setdefault(player_id, world_id)
+        
+        self._loaded = True
+        self.saver.mark_loaded()
     
-    def save_worlds(self):
-        """Сохранить миры"""
-        data = {world_id: world.to_dict() for world_id, world in self.worlds.items()}
+    def get_world(self, world_id):
+        """Мир по ID; спящий мир создаётся при первом обращении"""
+        world = self.worlds.get(world_id)
+        if world is None and world_id in self.dormant_worlds:
+            with stats.timer("activate_world"):
+                world = self._new_world(world_id)
+                world.load_from_dict(self.dormant_worlds[world_id])
+            # Снимок (WorldSaver) теперь берётся у живого мира
+            self.worlds[world_id] = world
+            del self.dormant_worlds[world_id]
+            stats.incr("worlds_activated")
+        return world
+    
+    def _new_world(self, world_id):
+        """Пустой мир, подгружающий данные из ленивого хранилища"""
+        return GameWorld(world_id, loader=self.storage if self.storage.lazy else None,
+                         generator=self.generator)
+    
+    def world_lock(self, world_id):
+        """Блокировка мира: изменения одного мира идут строго по очереди"""
+        lock = self.world_locks.get(world_id)
+        if lock is None:
+            lock = self.world_locks[world_id] = asyncio.Lock()
+        return lock
+    
+    def start(self):
+        """Запустить фоновое сохранение и выгрузку неактивных игроков
+        (внутри работающего цикла событий)"""
+        self.saver.start()
+        if self._loading is None and not self._loaded:
+            # Читаем хранилище заранее, пока бот подключается к Telegram
+            loop = asyncio.get_running_loop()
+            self._loading = loop.run_in_executor(self.io_executor, self.storage.load)
+        if not self._evict_task:
+            self._evict_task = asyncio.get_running_loop().create_task(self._evict_loop())
+    
+    def evict_idle_players(self, timeout=PLAYER_IDLE_TIMEOUT):
+        """Выгрузить из памяти игроков, не игравших timeout секунд"""
+        cutoff = time.monotonic() - timeout
+        return sum(world.evict_idle(cutoff, self.saver.unsaved_players(world_id))
+                   for world_id, world in self.worlds.items())
+    
+    async def _evict_loop(self):
+        # Память занимают активные игроки, а не все, кто когда-либо заходил
+        while True:
+            await asyncio.sleep(PLAYER_EVICT_INTERVAL)
+            try:
+                evicted = self.evict_idle_players()
+                if evicted:
+                    logger.info(f"Выгружено неактивных игроков: {evicted}")
+            except Exception as e:
+                logger.error(f"Ошибка выгрузки игроков: {e}")
+    
+    async def activate_player(self, user_id, reach=0):
+        """Подгрузить игрока и чанки вокруг него, не блокируя цикл событий
         
-        with open(WORLD_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2)
+        Заодно при первом обращении загружает список миров и активирует
+        мир игрока. Остальное нужно только ленивому хранилищу: после неё обращения к игроку и
+        его окрестности не читают диск в потоке цикла событий. reach -
+        на сколько клеток игрок ещё отойдёт (пачка нажатий).
+        
+        Возвращает мир игрока или None. Его и нужно использовать дальше:
+        get_player_world для неизвестного игрока искал бы его в хранилище
+        синхронно.
+        """
+        await self.ensure_loaded()
+        if not self.storage.lazy:
+            if user_id in self.player_worlds:
+                return self.get_world(self.player_worlds[user_id])
+            return None
+        
+        loop = asyncio.get_running_loop()
+        
+        if user_id not in self.player_worlds:
+            world_id = await loop.run_in_executor(
+                self.io_executor, self.storage.find_player_world, user_id)
+            if not world_id:
+                return None
+            self.player_worlds.setdefault(user_id, world_id)
+        
+        world = self.get_world(self.player_worlds[user_id])
+        if not world:
+            return None
+        
+        if user_id not in world.players:
+            player_data = await loop.run_in_executor(
+                self.io_executor, self.storage.load_player, world.world_id, user_id)
+            if not player_data:
+                return None
+            world.add_loaded_player(user_id, player_data)
+        
+        px, py, _ = world.players[user_id].position
+        chunks = world.missing_chunks(px, py, VIEW_SIZE // 2 + 1 + reach)
+        if chunks:
+            loaded = await loop.run_in_executor(
+                self.io_executor,
+                lambda: [(chunk, self.storage.load_chunk(world.world_id, *chunk)) for chunk in chunks])
+            for chunk, edits in loaded:
+                world.apply_chunk(chunk, edits)
+        return world
+    
+    def save_worlds(self):
+        """Сохранить изменения немедленно, не дожидаясь фоновой записи"""
+        return self.saver.flush()
+    
+    def close(self):
+        """Остановить фоновую запись и сохранить всё несохранённое"""
+        if self._evict_task:
+            self._evict_task.cancel()
+            self._evict_task = None
+        self.saver.close()
     
     def create_world(self, world_id="default"):
         """Создать новый мир"""
-        if world_id in self.worlds:
-            return self.worlds[world_id]
+        world = self.get_world(world_id)
+        if world:
+            return world
         
-        world = GameWorld(world_id)
+        world = self._new_world(world_id)
         self.worlds[world_id] = world
-        self.save_worlds()
         return world
     
-    def join_world(self, user_id, username, world_id="default"):
-        """Присоединиться к миру"""
-        # Проверяем, есть ли уже мир
-        if world_id not in self.worlds:
-            world = self.create_world(world_id)
-        else:
-            world = self.worlds[world_id]
+    def join_world(self, user_id, username, world_id="default", saved=True):
+        """Присоединиться к миру (saved=False - игрока нет в хранилище)"""
+        # Существующий мир или новый
+        world = self.create_world(world_id)
         
         # Добавляем/получаем игрока
-        player = world.add_player(user_id, username)
+        player = world.add_player(user_id, username, saved=saved)
         self.player_worlds[user_id] = world_id
-        self.save_worlds()
         
         return world, player
     
@@ -65,7 +220,14 @@ class MultiplayerManager:
         """Получить мир игрока"""
         if user_id in self.player_worlds:
             world_id = self.player_worlds[user_id]
-            return self.worlds.get(world_id)
+            return self.get_world(world_id)
+        
+        # Игрок мог ещё не подгрузиться из ленивого хранилища
+        if self.storage.lazy:
+            world_id = self.storage.find_player_world(user_id)
+            if world_id:
+                self.player_worlds[user_id] = world_id
+                return self.get_world(world_id)
         return None
     
     def get_online_players(self, user_id):
@@ -96,20 +258,18 @@ class MultiplayerManager:
             return None, 0
         
         # Ищем игрока на этой позиции
-        for player_id, player in world.players.items():
-            if str(player_id) != str(attacker_id):
-                px, py, pz = player.position
-                if px == target_x and py == target_y and pz == target_z:
-                    # Наносим урон
-                    damage = 1  # базовый урон
-                    alive = player.take_damage(damage)
-                    
-                    # Если умер - телепортируем на спавн
-                    if not alive:
-                        player.position = [0, 0, 21]
-                        player.health = 10
-                    
-                    self.save_worlds()
-                    return player.username, damage
-        
-        return None, 0
+        player = world.find_player_at_position(target_x, target_y, target_z, str(attacker_id))
+        if not player:
+            return None, 0
+        
+        # Наносим урон
+        damage = 1  # базовый урон
+        alive = player.take_damage(damage)
+        
+        # Если умер - телепортируем на спавн
+        if not alive:
+            world.set_player_position(player.user_id, 0, 0, 21)
+            player.health = 10
+        
+        world.mark_changed(player_id=player.user_id)
+        return player.username, damage
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from telegram.error import BadRequest, RetryAfter
+from config import CHAT_EDIT_RATE, CHAT_EDIT_BURST, GLOBAL_SEND_RATE
+from stats import stats
+
+logger = logging.getLogger(__name__)
+
+LAST_FRAMES_LIMIT = 10000  # Сколько последних отправленных кадров помнить
+
+
+class TokenBucket:
+    """Ограничение частоты: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_full(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+    async def acquire(self):
+        """Дождаться и забрать токен"""
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class EditScheduler:
+    """Очередь правок игровых сообщений
+
+    Для каждого сообщения хранится только последний кадр: пока правка
+    ждёт лимита, новые нажатия заменяют её, а не встают в очередь.
+    Кадр, совпадающий с последним отправленным, не отправляется вовсе.
+    Лимиты Telegram соблюдаются корзинами токенов на чат и на весь бот,
+    а на 429 (RetryAfter) отправка чата ждёт указанное время.
+    """
+
+    def __init__(self, chat_rate=CHAT_EDIT_RATE, chat_burst=CHAT_EDIT_BURST,
+                 global_rate=GLOBAL_SEND_RATE):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_buckets = {}  # chat_id: TokenBucket
+
+        self.pending = {}  # (chat_id, message_id): (text, reply_markup, send)
+        self.workers = {}  # (chat_id, message_id): asyncio.Task
+        self.last_frames = OrderedDict()  # (chat_id, message_id): (text, reply_markup)
+
+        # Счётчики
+        self.sent = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self.retries = 0
+
+    def submit(self, chat_id, message_id, text, reply_markup, send):
+        """Поставить кадр на отправку; send(text, reply_markup) - корутина правки"""
+        key = (chat_id, message_id)
+        if key in self.pending:
+            self.coalesced += 1
+        self.pending[key] = (text, reply_markup, send)
+
+        if key not in self.workers:
+            self.workers[key] = asyncio.get_running_loop().create_task(self._drain(key))
+
+    def counters(self):
+        """Счётчики для статистики"""
+        return {
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'skipped': self.skipped,
+            'retries': self.retries,
+            'pending': len(self.pending)
+        }
+
+    def _remember(self, key, text, reply_markup):
+        self.last_frames[key] = (text, reply_markup)
+        self.last_frames.move_to_end(key)
+        if len(self.last_frames) > LAST_FRAMES_LIMIT:
+            self.last_frames.popitem(last=False)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _drain(self, key):
+        """Отправлять последние кадры сообщения, пока они появляются"""
+        chat_id = key[0]
+        try:
+            while key in self.pending:
+                # Ждём лимиты до того, как забрать кадр: за это время
+                # его может заменить более свежий
+                await self._chat_bucket(chat_id).acquire()
+                await self.global_bucket.acquire()
+
+                text, reply_markup, send = self.pending.pop(key)
+                if self.last_frames.get(key) == (text, reply_markup):
+                    self.skipped += 1
+                    continue
+
+                try:
+                    with stats.timer("telegram_edit"):
+                        await send(text, reply_markup)
+                except RetryAfter as e:
+                    self.retries += 1
+                    delay = e.retry_after
+                    if hasattr(delay, 'total_seconds'):
+                        delay = delay.total_seconds()
+                    # Повторим этот кадр, если за время ожидания не пришёл новый
+                    self.pending.setdefault(key, (text, reply_markup, send))
+                    await asyncio.sleep(delay)
+                    continue
+                except BadRequest as e:
+                    if "not modified" not in str(e).lower():
+                        logger.error(f"Ошибка правки сообщения {key}: {e}")
+                        continue
+                except Exception as e:
+                    logger.error(f"Ошибка правки сообщения {key}: {e}")
+                    continue
+
+                self.sent += 1
+                self._remember(key, text, reply_markup)
+        finally:
+            del self.workers[key]
+            # Простаивающие корзины чатов не храним
+            if self.chat_buckets.get(chat_id) and self.chat_buckets[chat_id].is_full():
+                del self.chat_buckets[chat_id]
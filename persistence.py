@@ -0,0 +1,535 @@
+import asyncio
+import json
+import logging
+import os
+from config import (WORLD_FILE, SNAPSHOT_FILE, JOURNAL_FILE, SHARD_MARKER, SAVE_INTERVAL,
+                    JOURNAL_COMPACT_SIZE, STORAGE_BACKEND, REGION_FILES, REGION_DIR)
+from blocks import get_registry
+from chunks import ChunkStore, parse_key
+from regions import RegionStore, WorldRegions, world_region_dir, write_regions
+from snapshot import encode_snapshot, decode_snapshot, decode_player
+from stats import stats
+
+logger = logging.getLogger(__name__)
+
+
+def _encode(value):
+    """Компактный JSON без экранирования кириллицы"""
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def replay_journal(data, path=JOURNAL_FILE):
+    """Применить журнал к снимку data ({world_id: world_dict})
+
+    Записи хранят итоговые значения, поэтому повторное применение
+    уже учтённых в снимке записей ничего не ломает. Недописанная
+    последняя строка (падение во время записи) пропускается.
+    """
+    try:
+        f = open(path, 'r', encoding='utf-8')
+    except FileNotFoundError:
+        return 0
+
+    applied = 0
+    with f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logger.warning("Пропущена повреждённая запись журнала")
+                continue
+
+            world = data.setdefault(record['w'], {
+                'world_id': record['w'],
+                'global_modified_blocks': {},
+                'players': {}
+            })
+            players = world.setdefault('players', {})
+            player_id = record.get('p')
+
+            if player_id is not None and isinstance(players.get(player_id), bytes):
+                # Запись игрока из двоичного снимка
+                players[player_id] = decode_player(players[player_id])
+
+            if 's' in record:
+                # Состояние игрока, постройки сохраняются отдельно
+                player = players.setdefault(player_id, {'modified_blocks': {}})
+                player.update(record['s'])
+            elif 'k' in record:
+                if player_id is None:
+                    blocks = world.setdefault('global_modified_blocks', {})
+                else:
+                    player = players.setdefault(player_id, {'modified_blocks': {}})
+                    blocks = player.setdefault('modified_blocks', {})
+
+                if isinstance(blocks, ChunkStore):
+                    # Изменения из двоичного снимка
+                    x, y, z = parse_key(record['k'])
+                    if record['b'] is None:
+                        blocks.remove(x, y, z)
+                    else:
+                        blocks.set(x, y, z, get_registry().id_of(record['b']))
+                elif record['b'] is None:
+                    blocks.pop(record['k'], None)
+                else:
+                    blocks[record['k']] = record['b']
+            applied += 1
+
+    return applied
+
+
+class JournalStorage:
+    """Снимок SNAPSHOT_FILE плюс журнал изменений после него
+
+    Изменения дописываются в конец журнала строками JSON с fsync.
+    Когда журнал вырастает больше JOURNAL_COMPACT_SIZE, миры целиком
+    пишутся в снимок (snapshot.py), а журнал обнуляется. Пока двоичного
+    снимка нет, читается старый JSON-снимок legacy_path.
+
+    С region_files глобальные изменения миров при сжатии уходят не в
+    снимок, а в файлы регионов (regions.py) в region_dir. Мир, у которого
+    есть каталог регионов, всегда читается через RegionStore.
+    """
+
+    lazy = False  # Все миры и игроки загружаются при старте
+
+    def __init__(self, path=SNAPSHOT_FILE, journal_path=JOURNAL_FILE,
+                 compact_size=JOURNAL_COMPACT_SIZE, legacy_path=WORLD_FILE,
+                 region_dir=REGION_DIR, region_files=REGION_FILES):
+        self.path = path
+        self.journal_path = journal_path
+        self.legacy_path = legacy_path
+        self.region_dir = region_dir
+        self.region_files = region_files
+        self.compact_size = compact_size
+
+        try:
+            self.journal_size = os.path.getsize(journal_path)
+        except OSError:
+            self.journal_size = 0
+
+    def load(self):
+        """Миры целиком: {world_id: world_dict}"""
+        try:
+            with open(self.path, 'rb') as f:
+                data = decode_snapshot(f.read())
+        except FileNotFoundError:
+            data = self._load_legacy()
+
+        self._attach_regions(data)
+        replay_journal(data, self.journal_path)
+        return data
+
+    def _attach_regions(self, data):
+        """Глобальные изменения миров с каталогом регионов - через RegionStore"""
+        for world_id, world in data.items():
+            directory = world_region_dir(self.region_dir, world_id)
+            if not os.path.isdir(directory):
+                continue
+
+            # Изменения из снимка (мир ещё не был в регионах) поверх файлов
+            blocks = ChunkStore.from_dict(world.get('global_modified_blocks', {}))
+            store = RegionStore(WorldRegions(directory))
+            store.chunks, store.counts = blocks.chunks, blocks.counts
+            world['global_modified_blocks'] = store
+
+    def _load_legacy(self):
+        """Снимок в JSON из прошлых версий; при сжатии он перейдёт в SNAPSHOT_FILE"""
+        try:
+            with open(self.legacy_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        logger.info(f"Загружен старый снимок {self.legacy_path}")
+        return data
+
+    def wants_snapshot(self):
+        """Пора ли сжать журнал в снимок"""
+        return self.journal_size > self.compact_size
+
+    def write(self, records, snapshot=None):
+        """Дописать записи; если передан snapshot - сжать журнал в него
+
+        Возвращает число записанных байт.
+        """
+        written = 0
+        if records:
+            # Без буфера: при ошибке недописанный хвост обрезается, иначе
+            # он склеился бы с первой строкой повторной записи
+            data = "".join(_encode(record) + "\n" for record in records).encode('utf-8')
+            with open(self.journal_path, 'ab', buffering=0) as f:
+                start = f.seek(0, os.SEEK_END)
+                try:
+                    view = memoryview(data)
+                    while view:
+                        view = view[f.write(view):]
+                    os.fsync(f.fileno())
+                except OSError:
+                    f.truncate(start)
+                    raise
+                self.journal_size = f.tell()
+            written += len(data)
+
+        if snapshot is not None:
+            written += self.compact(snapshot)
+        return written
+
+    def compact(self, data):
+        """Записать полный снимок и очистить журнал
+
+        Файлы регионов пишутся раньше снимка: если запись прервётся,
+        журнал всё равно применится поверх них при загрузке.
+        """
+        written = self.write_snapshot(data, self.path)
+
+        # Всё из журнала уже есть в снимке
+        open(self.journal_path, 'w').close()
+        self.journal_size = 0
+        return written
+
+    def write_snapshot(self, data, path):
+        """Записать снимок (и файлы регионов) в path, не трогая журнал"""
+        written = 0
+        snapshot = {}
+        for world_id, world in data.items():
+            blocks = world.get('global_modified_blocks', {})
+            if self.region_files or isinstance(blocks, RegionStore):
+                # RegionStore хранит только изменённые чанки (опустевшие -
+                # тоже), обычный ChunkStore - все изменения мира: опустевший
+                # чанк из него удалён, поэтому регионы переписываются целиком
+                complete = not isinstance(blocks, RegionStore)
+                blocks = ChunkStore.from_dict(blocks) if isinstance(blocks, dict) else blocks
+                written += write_regions(world_region_dir(self.region_dir, world_id),
+                                         blocks.chunks, blocks.counts, complete)
+                world = {**world, 'global_modified_blocks': {}}
+            snapshot[world_id] = world
+
+        tmp_path = path + ".tmp"
+        encoded = encode_snapshot(snapshot)
+        with open(tmp_path, 'wb') as f:
+            f.write(encoded)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return written + len(encoded)
+
+    def close(self):
+        """Файлы закрываются после каждой записи"""
+
+
+def shard_path(path, shard):
+    """Файл шарда: world_data.mbs -> world_data.shard0.mbs"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{shard}{ext}"
+
+
+def create_storage(shard=None):
+    """Хранилище согласно STORAGE_BACKEND
+
+    База SQLite общая для всех процессов-шардов (каждый пишет только свои
+    миры), снимок и журнал у каждого шарда свои.
+    """
+    if STORAGE_BACKEND == "sqlite":
+        from sqlite_storage import SqliteStorage
+        return SqliteStorage()
+    if shard is not None:
+        return JournalStorage(shard_path(SNAPSHOT_FILE, shard), shard_path(JOURNAL_FILE, shard),
+                              legacy_path=shard_path(WORLD_FILE, shard))
+    return JournalStorage()
+
+
+def _shard_files(shard):
+    return [shard_path(path, shard) for path in (SNAPSHOT_FILE, JOURNAL_FILE, WORLD_FILE)]
+
+
+def _target_storage(count, shard):
+    """Хранилище шарда shard при count шардах (при одном - общие файлы)"""
+    return create_storage(shard=shard) if count > 1 else JournalStorage()
+
+
+def _read_count(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return int(f.read())
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def _finish_reshard(count, marker):
+    """Второй этап reshard: подставить записанные снимки (повторяемый)
+
+    Журнал очищается раньше замены снимка: пока лежит снимок .new, в
+    нём уже есть всё из журнала, и прерванный этап просто повторится.
+    """
+    for shard in range(count):
+        storage = _target_storage(count, shard)
+        staged = storage.path + ".new"
+        if os.path.exists(staged):
+            open(storage.journal_path, 'w').close()
+            os.replace(staged, storage.path)
+
+    if count > 1:
+        os.replace(marker + ".new", marker)
+    else:
+        if os.path.exists(marker):
+            os.remove(marker)
+        os.remove(marker + ".new")
+
+    # Файлы шардов, которых больше нет
+    shard = 0 if count == 1 else count
+    while any(os.path.exists(path) for path in _shard_files(shard)):
+        for path in _shard_files(shard):
+            if os.path.exists(path):
+                os.remove(path)
+        shard += 1
+
+
+def reshard(count, marker=SHARD_MARKER):
+    """Разложить сохранённые миры по count шардам (1 - без шардов)
+
+    Мир принадлежит шарду по HashRing, а его данные лежат в файлах
+    шарда, который сохранял его последним. Когда SHARD_COUNT меняется
+    (или шарды включают/выключают), миры один раз переписываются в
+    файлы новых владельцев - иначе шард не увидел бы свои миры, а при
+    сжатии журнала стёр бы чужие. Число шардов, под которое разложены
+    файлы, хранится в marker (нет файла - общий снимок без шардов).
+
+    Сначала новые снимки пишутся рядом (.new), затем marker.new
+    фиксирует перераспределение, и только потом снимки подставляются.
+    Вызывается до запуска миров; SQLite общая для шардов, ей это не нужно.
+    """
+    if STORAGE_BACKEND == "sqlite":
+        return False
+
+    pending = _read_count(marker + ".new")
+    if pending:
+        # Прошлое перераспределение прервали после фиксации
+        _finish_reshard(pending, marker)
+
+    saved_count = _read_count(marker)
+    saved_shards = list(range(saved_count))
+    # Файлы сверх записанного числа - от версий без marker
+    while any(os.path.exists(path) for path in _shard_files(len(saved_shards))):
+        saved_shards.append(len(saved_shards))
+    if count == max(saved_count, 1) and len(saved_shards) == saved_count:
+        return False
+
+    # Без marker актуален общий снимок, файлы шардов новее него
+    data = {}
+    if not saved_count:
+        data.update(JournalStorage().load())
+    for shard in saved_shards:
+        data.update(create_storage(shard=shard).load())
+
+    from shards import HashRing
+    ring = HashRing(range(count))
+    by_shard = {shard: {} for shard in range(count)}
+    for world_id, world in data.items():
+        by_shard[ring.shard_of(world_id) if count > 1 else 0][world_id] = world
+
+    for shard, worlds in by_shard.items():
+        storage = _target_storage(count, shard)
+        storage.write_snapshot(worlds, storage.path + ".new")
+
+    tmp_path = marker + ".new.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(str(count))
+    os.replace(tmp_path, marker + ".new")
+
+    _finish_reshard(count, marker)
+    logger.info(f"Миры ({len(data)}) разложены по шардам: {count}")
+    return True
+
+
+class WorldSaver:
+    """Отложенное сохранение миров
+
+    Игровой код только помечает изменения (GameWorld.mark_changed).
+    Раз в SAVE_INTERVAL секунд задача в цикле событий собирает их в
+    неизменяемые записи и отдаёт хранилищу в отдельном потоке ввода-вывода,
+    так что цикл событий никогда не ждёт диск:
+    {'w': мир} - новый мир,
+    {'w': мир, 'p': игрок, 's': состояние} - состояние игрока,
+    {'w': мир, 'p': игрок или None, 'k': "x,y,z", 'b': блок или None} - блок.
+
+    Если хранилище не смогло записать пачку (диск полон, база занята),
+    её записи уходят первыми в следующую запись: пометки изменений к
+    тому времени уже сняты, а игроки могли быть выгружены.
+
+    Миры, которые ещё не активировали (dormant), и чужие миры шарда
+    (foreign) попадают в снимок как есть. Пока менеджер не загрузил список миров (mark_loaded), снимок
+    не делается - в нём не хватало бы сохранённых миров.
+    """
+
+    def __init__(self, worlds, storage, executor, interval=SAVE_INTERVAL, dormant=None,
+                 foreign=None):
+        self.worlds = worlds  # world_id: GameWorld (общий словарь менеджера)
+        self.dormant = dormant if dormant is not None else {}  # world_id: данные хранилища
+        self.foreign = foreign if foreign is not None else {}  # world_id: данные хранилища
+        self.storage = storage
+        self.executor = executor  # Единственный поток ввода-вывода менеджера
+        self.interval = interval
+
+        # Миры, уже известные хранилищу
+        self._known_worlds = set(worlds) | set(self.dormant)
+        self._retry = []  # Записи неудавшейся записи
+        self._writing = []  # Записи, которые сейчас пишутся
+        self._loaded = dormant is None
+        self._task = None
+        self._closed = False
+
+    def _collect_world(self, world):
+        """Записи для накопленных изменений мира"""
+        players, blocks = world.pop_changes()
+        records = []
+
+        if world.world_id not in self._known_worlds:
+            self._known_worlds.add(world.world_id)
+            records.append({'w': world.world_id})
+
+        for pid in players:
+            player = world.players.get(pid)
+            if player:
+                records.append({'w': world.world_id, 'p': pid, 's': player.state_to_dict()})
+
+        for owner, (x, y, z) in blocks:
+            records.append({'w': world.world_id, 'p': owner, 'k': f"{x},{y},{z}",
+                            'b': world.get_edit(owner, x, y, z)})
+
+        return records
+
+    def mark_loaded(self):
+        """Список миров загружен: спящие миры уже есть в хранилище"""
+        self._known_worlds.update(self.dormant)
+        self._loaded = True
+
+    def collect(self):
+        """Снять изменения всех миров: (записи, снимок для сжатия или None)
+
+        Вызывается в потоке, который меняет миры; дальше данные
+        не связаны с живыми объектами.
+        """
+        records, self._retry = self._retry, []
+        for world in list(self.worlds.values()):
+            records.extend(self._collect_world(world))
+
+        snapshot = None
+        if self._loaded and self.storage.wants_snapshot():
+            # Данные спящих миров не меняются, их можно отдать как есть
+            snapshot = dict(self.foreign)
+            snapshot.update(self.dormant)
+            snapshot.update((world_id, world.to_snapshot()) for world_id, world in self.worlds.items())
+
+        return records, snapshot
+
+    def _compacted(self, snapshot):
+        """Снимок записан: миры в регионах освобождают записанные чанки
+
+        Вызывается в потоке цикла событий, как и collect.
+        """
+        for world_id, data in snapshot.items():
+            saved = data.get('global_modified_blocks')
+            if not isinstance(saved, RegionStore):
+                continue
+            world = self.worlds.get(world_id)
+            if world is not None:
+                blocks = world.global_blocks
+            else:
+                data = self.dormant.get(world_id) or self.foreign.get(world_id, {})
+                blocks = data.get('global_modified_blocks')
+            if isinstance(blocks, RegionStore):
+                blocks.compacted(saved)
+
+    def _write(self, records, snapshot):
+        """Запись в хранилище (в потоке ввода-вывода) со статистикой"""
+        with stats.timer("save"):
+            try:
+                written = self.storage.write(records, snapshot)
+            except Exception:
+                stats.incr("save_errors")
+                raise
+        stats.incr("saves")
+        stats.incr("records_saved", len(records))
+        stats.incr("bytes_written", written)
+        if snapshot is not None:
+            stats.incr("snapshots")
+
+    def unsaved_players(self, world_id):
+        """Игроки мира, чьи записи ещё не легли в хранилище
+
+        Пометки изменений с них уже сняты, но выгружать их нельзя: игрок
+        подгрузился бы из хранилища со старыми данными.
+        """
+        return {record['p'] for record in self._retry + self._writing
+                if record['w'] == world_id and record.get('p') is not None}
+
+    def _failed(self, records):
+        """Записи не сохранились: повторить их первыми (записи идемпотентны)
+
+        Снимок не повторяется - журнал не вырос, и collect снимет новый.
+        """
+        self._retry = records + self._retry
+
+    async def flush_async(self):
+        """Записать накопленные изменения, не блокируя цикл событий"""
+        records, snapshot = self.collect()
+        if not records and snapshot is None:
+            return False
+
+        loop = asyncio.get_running_loop()
+        self._writing = records
+        try:
+            await loop.run_in_executor(self.executor, self._write, records, snapshot)
+        except Exception:
+            self._failed(records)
+            raise
+        finally:
+            self._writing = []
+        if snapshot is not None:
+            self._compacted(snapshot)
+        return True
+
+    def flush(self):
+        """Записать накопленные изменения и дождаться записи"""
+        records, snapshot = self.collect()
+        if not records and snapshot is None:
+            return False
+
+        try:
+            self.executor.submit(self._write, records, snapshot).result()
+        except Exception:
+            self._failed(records)
+            raise
+        if snapshot is not None:
+            self._compacted(snapshot)
+        return True
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush_async()
+            except Exception as e:
+                logger.error(f"Ошибка сохранения миров: {e}")
+
+    def start(self):
+        """Запустить периодическую запись в текущем цикле событий"""
+        if not self._task:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def close(self):
+        """Остановить запись и дописать последние изменения"""
+        if self._closed:
+            return
+        self._closed = True
+
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+        # Ждём уже поставленные записи, последнюю пачку пишем сами
+        self.executor.shutdown(wait=True)
+        records, snapshot = self.collect()
+        if records or snapshot is not None:
+            self._write(records, snapshot)
+        self.storage.close()
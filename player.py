@@ -1,34 +1,63 @@
 # player.py
-import json
+import sys
+import time
 from config import MAX_HEALTH, ATTACK_DAMAGE, AIR_HEIGHT
+from chunks import ChunkStore
+from blocks import get_registry
 
 class Player:
+    """Игрок
+    
+    Слоты вместо __dict__, позиция - кортеж (x, y, z), инвентарь - по ID
+    предметов из общей палитры (blocks.py). Снаружи предметы по-прежнему
+    называются строками.
+    """
+    
+    __slots__ = ('user_id', 'username', 'position', 'health', 'inventory',
+                 'modified_blocks', 'last_active')
+    
     def __init__(self, user_id, username, spawn_x=0, spawn_y=0):
-        self.user_id = str(user_id)
+        self.user_id = sys.intern(str(user_id))
         self.username = username or "Игрок"
-        self.position = [spawn_x, spawn_y, AIR_HEIGHT + 1]  # На траве
+        self.position = (spawn_x, spawn_y, AIR_HEIGHT + 1)  # На траве
         self.health = MAX_HEALTH
-        self.inventory = {}
-        self.modified_blocks = {}  # Блоки, измененные этим игроком
+        self.inventory = {}  # item_id: количество
+        self.modified_blocks = ChunkStore()  # Блоки, измененные этим игроком
+        self.last_active = time.monotonic()  # Для выгрузки неактивных (GameWorld.evict_idle)
         
     def load_from_dict(self, data):
         """Загрузить из словаря"""
-        self.position = data.get('position', [0, 0, AIR_HEIGHT + 1])
+        self.position = tuple(data.get('position', (0, 0, AIR_HEIGHT + 1)))
         self.health = data.get('health', MAX_HEALTH)
-        self.inventory = data.get('inventory', {})
-        self.modified_blocks = data.get('modified_blocks', {})
+        id_of = get_registry().id_of
+        self.inventory = {id_of(item): count for item, count in data.get('inventory', {}).items()}
+        self.modified_blocks = ChunkStore.from_dict(data.get('modified_blocks', {}))
     
     def to_dict(self):
-        """Сохранить в словарь"""
+        """Сохранить в словарь (копия, безопасна для фонового сохранения)"""
+        data = self.state_to_dict()
+        data['modified_blocks'] = self.modified_blocks.to_dict()
+        return data
+    
+    def state_to_dict(self):
+        """Состояние игрока без его построек (для журнала)"""
         return {
             'user_id': self.user_id,
             'username': self.username,
-            'position': self.position,
+            'position': list(self.position),
             'health': self.health,
-            'inventory': self.inventory,
-            'modified_blocks': self.modified_blocks
+            'inventory': self.inventory_items()
         }
     
+    def inventory_items(self):
+        """Инвентарь по названиям предметов"""
+        names = get_registry().names
+        return {names[item_id]: count for item_id, count in self.inventory.items()}
+    
+    def inventory_size(self):
+        """Всего предметов"""
+        return sum(self.inventory.values())
+    
     def take_damage(self, damage):
         """Получить урон"""
         self.health = max(0, self.health - damage)
@@ -40,9 +69,8 @@ class Player:
     
     def move(self, dx, dy, dz):
         """Перемещение"""
-        self.position[0] += dx
-        self.position[1] += dy
-        self.position[2] += dz
+        x, y, z = self.position
+        self.position = (x + dx, y + dy, z + dz)
     
     def get_position_key(self):
         """Ключ позиции"""
@@ -51,20 +79,19 @@ class Player:
     
     def add_to_inventory(self, item, count=1):
         """Добавить в инвентарь"""
-        if item in self.inventory:
-            self.inventory[item] += count
-        else:
-            self.inventory[item] = count
+        item_id = get_registry().id_of(item)
+        self.inventory[item_id] = self.inventory.get(item_id, 0) + count
     
     def remove_from_inventory(self, item, count=1):
         """Убрать из инвентаря"""
-        if item in self.inventory:
-            self.inventory[item] -= count
-            if self.inventory[item] <= 0:
-                del self.inventory[item]
+        item_id = get_registry().ids.get(item)
+        if item_id in self.inventory:
+            self.inventory[item_id] -= count
+            if self.inventory[item_id] <= 0:
+                del self.inventory[item_id]
             return True
         return False
     
     def has_inventory(self, item, count=1):
         """Проверить наличие в инвентаре"""
-        return self.inventory.get(item, 0) >= count
+        return self.inventory.get(get_registry().ids.get(item), 0) >= count
@@ -0,0 +1,304 @@
+"""Файлы регионов: глобальные изменения больших миров на диске
+
+Регион - REGION_SIZE×REGION_SIZE столбцов чанков, один файл
+r.<region_x>.<region_y>.mbr в каталоге мира. Файл читается через mmap:
+заголовок фиксированного размера с индексом столбцов позволяет найти
+чанк по смещению, не разбирая файл, а вытеснением прочитанного
+занимается страничный кэш ОС.
+
+    MAGIC, версия, размер палитры
+    индекс: для каждого столбца (смещение, число секций)
+    палитра: названия блоков через \\n (ID в файле 1..n)
+    секции: chunk_z, число изменённых блоков и CHUNK_VOLUME байт чанка
+"""
+import mmap
+import os
+import struct
+from urllib.parse import quote
+
+from config import REGION_SIZE
+from blocks import EMPTY, get_registry
+from chunks import ChunkStore, SHIFT, MASK, CHUNK_VOLUME
+
+assert REGION_SIZE & (REGION_SIZE - 1) == 0, "REGION_SIZE должен быть степенью двойки"
+REGION_SHIFT = REGION_SIZE.bit_length() - 1
+REGION_MASK = REGION_SIZE - 1
+
+MAGIC = b"MBRG"
+VERSION = 1
+HEADER = struct.Struct("<4sBxxxI")  # MAGIC, версия, размер палитры в байтах
+ENTRY = struct.Struct("<IHxx")  # смещение секций столбца, число секций
+SECTION = struct.Struct("<iI")  # chunk_z, число изменённых блоков
+INDEX_OFFSET = HEADER.size
+PALETTE_OFFSET = INDEX_OFFSET + ENTRY.size * REGION_SIZE * REGION_SIZE
+
+
+def world_region_dir(root, world_id):
+    """Каталог регионов мира (world_id может содержать любые символы)"""
+    return os.path.join(root, quote(world_id, safe=''))
+
+
+def region_path(directory, region_x, region_y):
+    return os.path.join(directory, f"r.{region_x}.{region_y}.mbr")
+
+
+class RegionFile:
+    """Один регион поверх буфера (mmap или прочитанные байты)"""
+
+    def __init__(self, buffer, name=""):
+        self.view = memoryview(buffer)
+        magic, version, palette_size = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{name}: это не файл региона")
+        if version != VERSION:
+            raise ValueError(f"{name}: неизвестная версия региона {version}")
+
+        # ID файла -> ID текущей палитры; обычно они совпадают
+        names = bytes(self.view[PALETTE_OFFSET:PALETTE_OFFSET + palette_size]).decode('utf-8')
+        registry = get_registry()
+        ids = [0] + [registry.id_of(name) for name in names.split('\n') if name]
+        self.table = None
+        if ids != list(range(len(ids))):
+            self.table = bytes(ids + [0] * (256 - len(ids)))
+
+    @classmethod
+    def open(cls, path):
+        """Регион из файла через mmap (только чтение)"""
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(mapped, path)
+
+    def sections(self, local_x, local_y):
+        """Секции столбца: [(chunk_z, смещение чанка, число блоков)]"""
+        offset, count = ENTRY.unpack_from(
+            self.view, INDEX_OFFSET + ENTRY.size * (local_y * REGION_SIZE + local_x))
+        result = []
+        for _ in range(count):
+            chunk_z, blocks = SECTION.unpack_from(self.view, offset)
+            result.append((chunk_z, offset + SECTION.size, blocks))
+            offset += SECTION.size + CHUNK_VOLUME
+        return result
+
+    def chunk(self, offset):
+        """Чанк по смещению: срез mmap без копирования"""
+        data = self.view[offset:offset + CHUNK_VOLUME]
+        return data if self.table is None else bytes(data).translate(self.table)
+
+    def all_chunks(self, region_x, region_y):
+        """Все чанки региона: (ключ, массив, число блоков)"""
+        for local_y in range(REGION_SIZE):
+            for local_x in range(REGION_SIZE):
+                chunk_x = region_x << REGION_SHIFT | local_x
+                chunk_y = region_y << REGION_SHIFT | local_y
+                for chunk_z, offset, count in self.sections(local_x, local_y):
+                    yield (chunk_x, chunk_y, chunk_z), self.chunk(offset), count
+
+
+class WorldRegions:
+    """Файлы регионов одного мира, только чтение
+
+    Файл открывается при первом обращении к его региону, найденные
+    чанки (срезы mmap) запоминаются.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}  # (region_x, region_y): RegionFile или None
+        self.found = {}  # (chunk_x, chunk_y, chunk_z): (чанк, число блоков) или None
+
+    def region(self, region_x, region_y):
+        key = (region_x, region_y)
+        if key not in self.files:
+            path = region_path(self.path, region_x, region_y)
+            self.files[key] = RegionFile.open(path) if os.path.exists(path) else None
+        return self.files[key]
+
+    def get(self, chunk_key):
+        """(чанк, число блоков) из файла или None"""
+        try:
+            return self.found[chunk_key]
+        except KeyError:
+            pass
+
+        chunk_x, chunk_y, chunk_z = chunk_key
+        result = None
+        region = self.region(chunk_x >> REGION_SHIFT, chunk_y >> REGION_SHIFT)
+        if region:
+            for section_z, offset, count in region.sections(chunk_x & REGION_MASK,
+                                                            chunk_y & REGION_MASK):
+                if section_z == chunk_z:
+                    result = (region.chunk(offset), count)
+                    break
+        self.found[chunk_key] = result
+        return result
+
+    def all_chunks(self):
+        """Все чанки всех регионов мира (читает каждый файл целиком)"""
+        for region_x, region_y in _region_files(self.path):
+            region = self.region(region_x, region_y)
+            if region:
+                yield from region.all_chunks(region_x, region_y)
+
+
+class RegionStore(ChunkStore):
+    """Глобальные изменения мира, записанные в файлы регионов
+
+    Записанные чанки читаются из файлов (WorldRegions), в памяти (chunks)
+    только чанки, изменённые с последнего сжатия. Опустевший чанк тоже
+    остаётся в памяти, иначе сквозь него проступили бы данные файла.
+    """
+
+    def __init__(self, regions):
+        super().__init__()
+        self.regions = regions
+
+    def __len__(self):
+        return sum(count for _, _, count in self.all_chunks())
+
+    def chunk_at(self, chunk_key):
+        chunk = self.chunks.get(chunk_key)
+        if chunk is None:
+            stored = self.regions.get(chunk_key)
+            if stored:
+                chunk = stored[0]
+        return chunk
+
+    def get(self, x, y, z):
+        chunk = self.chunk_at((x >> SHIFT, y >> SHIFT, z >> SHIFT))
+        if chunk is None:
+            return EMPTY
+        return chunk[(z & MASK) << (2 * SHIFT) | (y & MASK) << SHIFT | (x & MASK)]
+
+    def _materialize(self, chunk_key):
+        """Перенести чанк из файла в память перед изменением"""
+        if chunk_key not in self.chunks:
+            stored = self.regions.get(chunk_key)
+            if stored:
+                self.chunks[chunk_key] = bytearray(stored[0])
+                self.counts[chunk_key] = stored[1]
+
+    def set(self, x, y, z, block_id):
+        self._materialize((x >> SHIFT, y >> SHIFT, z >> SHIFT))
+        super().set(x, y, z, block_id)
+
+    def remove(self, x, y, z):
+        chunk_key = (x >> SHIFT, y >> SHIFT, z >> SHIFT)
+        self._materialize(chunk_key)
+        chunk = self.chunks.get(chunk_key)
+        if chunk is None:
+            return False
+
+        index = (z & MASK) << (2 * SHIFT) | (y & MASK) << SHIFT | (x & MASK)
+        if chunk[index] == EMPTY:
+            return False
+
+        chunk[index] = EMPTY
+        self.counts[chunk_key] -= 1
+        return True
+
+    def all_chunks(self):
+        result = [(key, chunk, count) for key, chunk, count in self.regions.all_chunks()
+                  if key not in self.chunks]
+        result.extend((key, chunk, self.counts[key]) for key, chunk in self.chunks.items()
+                      if self.counts[key])
+        return result
+
+    def copy(self):
+        """Копия изменений в памяти, файлы общие"""
+        store = RegionStore(self.regions)
+        store.chunks = {key: bytearray(chunk) for key, chunk in self.chunks.items()}
+        store.counts = dict(self.counts)
+        return store
+
+    def compacted(self, saved):
+        """Изменения saved записаны в файлы: перечитать их и освободить память"""
+        self.regions = WorldRegions(self.regions.path)
+        for chunk_key, chunk in list(saved.chunks.items()):
+            if self.chunks.get(chunk_key) == chunk:
+                del self.chunks[chunk_key]
+                del self.counts[chunk_key]
+
+
+def _encode_region(sections):
+    """{ключ: (чанк, число блоков)} одного региона -> байты файла"""
+    columns = {}
+    for (chunk_x, chunk_y, chunk_z), (chunk, count) in sorted(sections.items()):
+        columns.setdefault((chunk_x & REGION_MASK, chunk_y & REGION_MASK), []).append(
+            (chunk_z, chunk, count))
+
+    palette = '\n'.join(get_registry().names[1:]).encode('utf-8')
+    index = bytearray(PALETTE_OFFSET - INDEX_OFFSET)
+    body = bytearray()
+    offset = PALETTE_OFFSET + len(palette)
+    for (local_x, local_y), column in columns.items():
+        ENTRY.pack_into(index, ENTRY.size * (local_y * REGION_SIZE + local_x),
+                        offset + len(body), len(column))
+        for chunk_z, chunk, count in column:
+            body += SECTION.pack(chunk_z, count)
+            body += chunk
+
+    return HEADER.pack(MAGIC, VERSION, len(palette)) + bytes(index) + palette + bytes(body)
+
+
+def _region_files(directory):
+    """{(region_x, region_y): имя файла} каталога мира"""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return {}
+    files = {}
+    for name in names:
+        parts = name.split('.')
+        if len(parts) == 4 and parts[0] == 'r' and parts[3] == 'mbr':
+            files[(int(parts[1]), int(parts[2]))] = name
+    return files
+
+
+def write_regions(directory, chunks, counts, complete=False):
+    """Записать изменённые чанки в файлы регионов каталога мира
+
+    chunks/counts - как у ChunkStore, чанк с нулём блоков удаляется.
+    Каждый затронутый регион переписывается целиком через временный
+    файл. С complete chunks - все изменения мира: секции и файлы, которых
+    в них нет, удаляются. Возвращает число записанных байт.
+    """
+    by_region = {}
+    for chunk_key, chunk in chunks.items():
+        region_key = (chunk_key[0] >> REGION_SHIFT, chunk_key[1] >> REGION_SHIFT)
+        by_region.setdefault(region_key, {})[chunk_key] = (chunk, counts[chunk_key])
+
+    if complete:
+        for region_key, name in _region_files(directory).items():
+            if region_key not in by_region:
+                os.remove(os.path.join(directory, name))
+    if not by_region:
+        return 0
+
+    os.makedirs(directory, exist_ok=True)
+    written = 0
+    for (region_x, region_y), changed in by_region.items():
+        path = region_path(directory, region_x, region_y)
+        sections = {}
+        if not complete and os.path.exists(path):
+            # Читаем копию, а не mmap: файл сейчас будет заменён
+            with open(path, 'rb') as f:
+                region = RegionFile(f.read(), path)
+            for chunk_key, chunk, count in region.all_chunks(region_x, region_y):
+                sections[chunk_key] = (chunk, count)
+
+        for chunk_key, (chunk, count) in changed.items():
+            if count:
+                sections[chunk_key] = (chunk, count)
+            else:
+                sections.pop(chunk_key, None)
+
+        data = _encode_region(sections)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        written += len(data)
+
+    return written
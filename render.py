@@ -0,0 +1,59 @@
+from collections import OrderedDict
+from functools import lru_cache
+from config import ROW_CACHE_SIZE, FRAME_CACHE_SIZE
+from blocks import get_registry
+
+
+class ViewRenderer:
+    """HTML-отрисовка вида из строк ID блоков
+
+    HTML-фрагменты блоков - таблица палитры (BlockRegistry.emoji_html),
+    строки вида кэшируются по их ID, а неизменившийся кадр игрока
+    отдаётся целиком из прошлой отрисовки. Кадры помнятся только для
+    frame_cache_size последних игроков.
+    """
+
+    def __init__(self, row_cache_size=ROW_CACHE_SIZE, frame_cache_size=FRAME_CACHE_SIZE):
+        # Тот же список, что у палитры: новые блоки появляются в нём сами
+        self.fragments = get_registry().emoji_html
+        self._render_row = lru_cache(maxsize=row_cache_size)(self._build_row)
+        self._frames = OrderedDict()  # player_id: (ID всех клеток, HTML)
+        self.frame_cache_size = frame_cache_size
+        self.frame_hits = 0
+        self.frame_misses = 0
+
+    def _build_row(self, row):
+        fragments = self.fragments
+        return "".join([fragments[block_id] for block_id in row])
+
+    def render(self, view, player_id=None):
+        """HTML вида; с player_id повторный одинаковый кадр берётся из кэша"""
+        if player_id is not None:
+            key = b"".join(view)
+            cached = self._frames.get(player_id)
+            if cached and cached[0] == key:
+                self.frame_hits += 1
+                self._frames.move_to_end(player_id)
+                return cached[1]
+            self.frame_misses += 1
+
+        text = "".join([self._render_row(bytes(row)) + "\n" for row in view])
+
+        if player_id is not None:
+            self._frames[player_id] = (key, text)
+            self._frames.move_to_end(player_id)
+            if len(self._frames) > self.frame_cache_size:
+                self._frames.popitem(last=False)
+        return text
+
+    def cache_stats(self):
+        """Счётчики кэшей строк и кадров"""
+        rows = self._render_row.cache_info()
+        return {
+            'row_hits': rows.hits,
+            'row_misses': rows.misses,
+            'row_size': rows.currsize,
+            'frame_hits': self.frame_hits,
+            'frame_misses': self.frame_misses,
+            'frames': len(self._frames)
+        }
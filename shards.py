@@ -0,0 +1,257 @@
+import asyncio
+import bisect
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import signal
+from config import SHARD_COUNT, SHARD_REPLICAS
+from stats import stats, merge_snapshots
+
+logger = logging.getLogger(__name__)
+
+
+class HashRing:
+    """Консистентное хеширование миров по шардам
+
+    У каждого шарда replicas точек на кольце, поэтому при изменении
+    числа шардов переезжает только часть миров.
+    """
+
+    def __init__(self, shards, replicas=SHARD_REPLICAS):
+        self.points = []
+        self.shards = []
+        for point, shard in sorted((self._hash(f"{shard}:{replica}"), shard)
+                                   for shard in shards for replica in range(replicas)):
+            self.points.append(point)
+            self.shards.append(shard)
+
+    @staticmethod
+    def _hash(key):
+        # Стабильный между процессами хеш (hash() зависит от PYTHONHASHSEED)
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+    def shard_of(self, key):
+        """Шард, которому принадлежит ключ (world_id)"""
+        index = bisect.bisect(self.points, self._hash(key)) % len(self.points)
+        return self.shards[index]
+
+
+def shard_main(index, count, conn):
+    """Точка входа процесса-шарда"""
+    # Ctrl+C получает вся группа процессов, а останавливает шарды бот
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(
+        format=f'%(asctime)s - shard{index} - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+
+    # Импорт здесь: главному процессу в режиме шардов миры не нужны
+    from multiplayer import MultiplayerManager
+    from persistence import create_storage
+
+    ring = HashRing(range(count))
+    multiplayer = MultiplayerManager(
+        storage=create_storage(shard=index),
+        owns_world=lambda world_id: ring.shard_of(world_id) == index
+    )
+    asyncio.run(_serve_shard(multiplayer, conn))
+
+
+async def _serve_shard(multiplayer, conn):
+    """Выполнять запросы бота по очереди, пока он не попросит остановиться"""
+    from game_handlers import play_actions, render_screen, join_player, debug_info, collect_stats
+
+    async def locate(multiplayer, user_id):
+        world = await multiplayer.activate_player(user_id)
+        return world.world_id if world else None
+
+    operations = {
+        "play": play_actions,
+        "show": render_screen,
+        "join": join_player,
+        "debug": debug_info,
+        "stats": collect_stats,
+        "locate": locate
+    }
+
+    loop = asyncio.get_running_loop()
+    requests = asyncio.Queue()
+
+    def on_readable():
+        try:
+            requests.put_nowait(conn.recv())
+        except EOFError:
+            # Бот завершился, не попрощавшись
+            loop.remove_reader(conn.fileno())
+            requests.put_nowait(None)
+
+    loop.add_reader(conn.fileno(), on_readable)
+    multiplayer.start()
+
+    try:
+        # Запросы выполняются строго по порядку прихода: бот шлёт их
+        # в порядке обработки, значит порядок внутри мира сохраняется
+        while True:
+            request = await requests.get()
+            if request is None:
+                break
+
+            request_id, operation, args = request
+            try:
+                result = await operations[operation](multiplayer, *args)
+            except Exception as e:
+                logger.exception(f"Ошибка запроса {operation}")
+                conn.send((request_id, None, repr(e)))
+            else:
+                conn.send((request_id, result, None))
+    finally:
+        loop.remove_reader(conn.fileno())
+        multiplayer.close()
+        conn.close()
+
+
+class ShardRouter:
+    """Миры в процессах-шардах (SHARD_COUNT > 1)
+
+    Мир принадлежит шарду по консистентному хешу world_id. Бот пересылает
+    шарду действия игрока через multiprocessing.Pipe и получает обратно
+    готовый экран. Каждый шард выполняет запросы по очереди, поэтому
+    порядок действий внутри мира сохраняется, а разные миры считаются
+    на разных ядрах. Интерфейс тот же, что у game_handlers.LocalGame.
+
+    Пока все команды входа ведут в мир "default", все игроки оказываются
+    в одном шарде: выигрыш появится, когда миров станет несколько.
+    Файлы миров раскладывает по шардам persistence.reshard (main.py).
+    """
+
+    def __init__(self, count=SHARD_COUNT):
+        self.count = count
+        self.ring = HashRing(range(count))
+        self.processes = []
+        self.conns = []
+        self.waiters = {}  # request_id: (шард, asyncio.Future)
+        self.dead = set()  # Шарды, процесс которых завершился
+        self.request_ids = itertools.count()
+        self.loop = None
+        self.player_worlds = {}  # user_id: world_id (кэш ответов шардов)
+
+    def start(self):
+        """Запустить процессы-шарды (внутри работающего цикла событий)"""
+        loop = self.loop = asyncio.get_running_loop()
+        # spawn: шард не наследует состояние бота и его цикл событий
+        context = multiprocessing.get_context("spawn")
+
+        for index in range(self.count):
+            conn, child_conn = context.Pipe()
+            process = context.Process(target=shard_main, args=(index, self.count, child_conn),
+                                      name=f"shard-{index}", daemon=True)
+            process.start()
+            child_conn.close()
+
+            self.processes.append(process)
+            self.conns.append(conn)
+            loop.add_reader(conn.fileno(), self._on_reply, index)
+
+    def _on_reply(self, shard):
+        conn = self.conns[shard]
+        try:
+            request_id, result, error = conn.recv()
+        except (EOFError, OSError):
+            self.loop.remove_reader(conn.fileno())
+            self.dead.add(shard)
+            logger.error(f"Процесс shard-{shard} завершился")
+            # Ответов на его запросы уже не будет
+            for request_id, (waiting_shard, future) in list(self.waiters.items()):
+                if waiting_shard == shard:
+                    del self.waiters[request_id]
+                    if not future.done():
+                        future.set_exception(RuntimeError(f"Шард {shard} завершился"))
+            return
+
+        _, future = self.waiters.pop(request_id, (None, None))
+        if future is None or future.done():
+            return
+        if error:
+            future.set_exception(RuntimeError(f"Ошибка в шарде: {error}"))
+        else:
+            future.set_result(result)
+
+    async def call(self, shard, operation, *args):
+        """Выполнить операцию game_handlers в шарде"""
+        if shard in self.dead:
+            raise RuntimeError(f"Шард {shard} завершился")
+        request_id = next(self.request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[request_id] = (shard, future)
+        try:
+            self.conns[shard].send((request_id, operation, args))
+        except OSError:
+            del self.waiters[request_id]
+            raise
+        return await future
+
+    async def world_of(self, user_id):
+        """Мир игрока (спрашиваем все шарды, если ещё не знаем)"""
+        world_id = self.player_worlds.get(user_id)
+        if world_id is None:
+            found = await asyncio.gather(*(self.call(shard, "locate", user_id)
+                                           for shard in range(self.count)))
+            world_id = next((world_id for world_id in found if world_id), None)
+            if world_id:
+                self.player_worlds[user_id] = world_id
+        return world_id
+
+    async def play(self, user_id, username, queue):
+        # Без мира игрок автоматически попадает в дефолтный
+        world_id = await self.world_of(user_id) or "default"
+        shard = self.ring.shard_of(world_id)
+
+        # Нажатия, пришедшие пока шард считал предыдущие, отправляем
+        # следующей пачкой
+        while queue:
+            actions = queue[:]
+            del queue[:]
+            screen = await self.call(shard, "play", user_id, username, actions)
+
+        self.player_worlds[user_id] = world_id
+        return screen
+
+    async def show(self, user_id, message=""):
+        world_id = await self.world_of(user_id)
+        if not world_id:
+            return None
+        return await self.call(self.ring.shard_of(world_id), "show", user_id, message)
+
+    async def join(self, user_id, username, world_id="default"):
+        await self.call(self.ring.shard_of(world_id), "join", user_id, username, world_id)
+        self.player_worlds[user_id] = world_id
+
+    async def debug(self, user_id):
+        world_id = await self.world_of(user_id)
+        if not world_id:
+            return "❌ Нет мира"
+        return await self.call(self.ring.shard_of(world_id), "debug", user_id)
+
+    async def stats(self):
+        """Статистика бота и всех шардов"""
+        shards = await asyncio.gather(*(self.call(shard, "stats") for shard in range(self.count)))
+        return merge_snapshots([stats.snapshot()] + list(shards))
+
+    def close(self):
+        """Остановить шарды; каждый перед выходом сохраняет свои миры"""
+        for conn in self.conns:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+        for process in self.processes:
+            process.join(timeout=30)
+            if process.is_alive():
+                logger.error(f"{process.name} не остановился, завершаем")
+                process.terminate()
+
+        for shard, conn in enumerate(self.conns):
+            if shard not in self.dead:
+                self.loop.remove_reader(conn.fileno())
+            conn.close()
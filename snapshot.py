@@ -0,0 +1,304 @@
+"""Двоичный формат снимка миров (SNAPSHOT_FILE)
+
+Заголовок MAGIC + номер версии, дальше поток zlib:
+    палитра: число названий, названия (ID в файле 1..n, 0 - «нет изменения»)
+    миры: число миров, для каждого
+        world_id
+        глобальные изменения (блоки)
+        игроки: число игроков, для каждого id и запись игрока
+    запись игрока: длина, JSON состояния, постройки (блоки)
+    блоки: число чанков, для каждого chunk_x, chunk_y, chunk_z, число
+        изменённых блоков и сами блоки: до SPARSE_LIMIT - парами (шаг
+        индекса, ID палитры файла), иначе все CHUNK_VOLUME байт чанка
+        (как ChunkStore.chunks)
+Числа - varint, координаты чанков - zigzag varint, строки - длина и UTF-8.
+
+Запись игрока в том же виде хранится в памяти у выгруженных игроков
+(GameWorld.offline_players), поэтому при чтении снимка и сжатии журнала
+игроки, которые не заходили, не разбираются вовсе.
+
+Старый world_data.json переводится командой
+
+    python snapshot.py [world_data.json [world_data.mbs]]
+
+она же читает результат обратно и сверяет его с исходным снимком.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import zlib
+
+from config import WORLD_FILE, SNAPSHOT_FILE
+from blocks import get_registry
+from chunks import ChunkStore, CHUNK_VOLUME, changed_indexes
+
+MAGIC = b"MBWS"
+VERSION = 1
+COMPRESS_LEVEL = 6
+SPARSE_LIMIT = CHUNK_VOLUME // 8  # Чанки, где изменено меньше блоков, пишутся парами
+
+
+def _write_varint(out, value):
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _write_signed(out, value):
+    _write_varint(out, value << 1 if value >= 0 else (-value << 1) - 1)
+
+
+def _write_string(out, text):
+    data = text.encode('utf-8')
+    _write_varint(out, len(data))
+    out += data
+
+
+def _write_blocks(out, blocks):
+    """Изменения блоков: ChunkStore или {"x,y,z": название}"""
+    if not isinstance(blocks, ChunkStore):
+        blocks = ChunkStore.from_dict(blocks)
+
+    chunks = list(blocks.all_chunks())
+    _write_varint(out, len(chunks))
+    for chunk_key, chunk, count in chunks:
+        for coordinate in chunk_key:
+            _write_signed(out, coordinate)
+
+        _write_varint(out, count)
+        if count > SPARSE_LIMIT:
+            out += chunk
+            continue
+
+        previous = -1
+        chunk = bytes(chunk)  # Может быть срезом mmap (regions.RegionStore)
+        for index in changed_indexes(chunk):
+            _write_varint(out, index - previous - 1)
+            out.append(chunk[index])
+            previous = index
+
+
+def encode_player(player):
+    """Данные игрока (как Player.to_dict, постройки можно ChunkStore) -> запись"""
+    out = bytearray()
+    state = {key: value for key, value in player.items() if key != 'modified_blocks'}
+    _write_string(out, json.dumps(state, ensure_ascii=False, separators=(',', ':')))
+    _write_blocks(out, player.get('modified_blocks', {}))
+    return bytes(out)
+
+
+def encode_snapshot(data):
+    """{world_id: world_dict} -> байты снимка
+
+    Изменения блоков в world_dict могут быть ChunkStore
+    (GameWorld.to_snapshot) или словарём, как в world_data.json, игроки -
+    словарями или готовыми записями (encode_player).
+    """
+    out = bytearray()
+
+    # ID в чанках - ID общей палитры, поэтому палитра файла - она же.
+    # Её нужно снять после _write_blocks: словарь может добавить блоки
+    body = bytearray()
+    _write_varint(body, len(data))
+    for world_id, world in data.items():
+        _write_string(body, world.get('world_id', world_id))
+        _write_blocks(body, world.get('global_modified_blocks', {}))
+
+        players = world.get('players', {})
+        _write_varint(body, len(players))
+        for player_id, player in players.items():
+            record = player if isinstance(player, bytes) else encode_player(player)
+            _write_string(body, player_id)
+            _write_varint(body, len(record))
+            body += record
+
+    names = get_registry().names
+    _write_varint(out, len(names) - 1)
+    for name in names[1:]:
+        _write_string(out, name)
+    out += body
+
+    return MAGIC + bytes([VERSION]) + zlib.compress(out, COMPRESS_LEVEL)
+
+
+class _Reader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def varint(self):
+        value = shift = 0
+        while True:
+            byte = self.data[self.pos]
+            self.pos += 1
+            value |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def signed(self):
+        value = self.varint()
+        return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+    def raw(self, size):
+        start = self.pos
+        self.pos += size
+        if self.pos > len(self.data):
+            raise ValueError("Снимок обрезан")
+        return self.data[start:self.pos]
+
+    def string(self):
+        return bytes(self.raw(self.varint())).decode('utf-8')
+
+
+def _read_blocks(reader, table):
+    store = ChunkStore()
+    for _ in range(reader.varint()):
+        chunk_key = (reader.signed(), reader.signed(), reader.signed())
+        count = reader.varint()
+
+        if count > SPARSE_LIMIT:
+            chunk = bytearray(reader.raw(CHUNK_VOLUME))
+            if table is not None:
+                chunk = chunk.translate(table)
+        else:
+            chunk = bytearray(CHUNK_VOLUME)
+            index = -1
+            for _ in range(count):
+                index += reader.varint() + 1
+                block_id = reader.data[reader.pos]
+                reader.pos += 1
+                chunk[index] = table[block_id] if table is not None else block_id
+
+        store.chunks[chunk_key] = chunk
+        store.counts[chunk_key] = count
+    return store
+
+
+def decode_player(record, table=None):
+    """Запись игрока -> данные игрока (постройки - ChunkStore)"""
+    reader = _Reader(memoryview(record))
+    player = json.loads(reader.string())
+    player['modified_blocks'] = _read_blocks(reader, table)
+    return player
+
+
+def decode_snapshot(raw):
+    """Байты снимка -> {world_id: world_dict}
+
+    Глобальные изменения возвращаются готовым ChunkStore (GameWorld
+    копирует его при загрузке), игроки - записями encode_player.
+    """
+    if raw[:len(MAGIC)] != MAGIC:
+        raise ValueError("Это не снимок миров")
+    version = raw[len(MAGIC)]
+    if version != VERSION:
+        raise ValueError(f"Неизвестная версия снимка: {version}")
+
+    reader = _Reader(memoryview(zlib.decompress(raw[len(MAGIC) + 1:])))
+
+    # ID файла -> ID текущей палитры; если совпадают, чанки не перекодируются
+    registry = get_registry()
+    ids = [0] + [registry.id_of(reader.string()) for _ in range(reader.varint())]
+    table = None
+    if ids != list(range(len(ids))):
+        table = bytes(ids + [0] * (256 - len(ids)))
+
+    data = {}
+    for _ in range(reader.varint()):
+        world_id = reader.string()
+        world = data[world_id] = {
+            'world_id': world_id,
+            'global_modified_blocks': _read_blocks(reader, table),
+            'players': {}
+        }
+        for _ in range(reader.varint()):
+            player_id = reader.string()
+            record = bytes(reader.raw(reader.varint()))
+            if table is not None:
+                # Записи в памяти - в ID текущей палитры
+                record = encode_player(decode_player(record, table))
+            world['players'][player_id] = record
+
+    return data
+
+
+def to_json_format(world):
+    """Данные мира в виде world_data.json"""
+    blocks = world.get('global_modified_blocks', {})
+    players = {}
+    for player_id, player in world.get('players', {}).items():
+        if isinstance(player, bytes):
+            player = decode_player(player)
+        player = {'modified_blocks': {}, **player}
+        if isinstance(player['modified_blocks'], ChunkStore):
+            player['modified_blocks'] = player['modified_blocks'].to_dict()
+        players[player_id] = player
+
+    return {
+        'world_id': world.get('world_id'),
+        'global_modified_blocks': blocks.to_dict() if isinstance(blocks, ChunkStore) else blocks,
+        'players': players
+    }
+
+
+def verify_snapshot(data, raw):
+    """Совпадает ли снимок raw с данными data"""
+    decoded = decode_snapshot(raw)
+    return decoded.keys() == data.keys() and all(
+        to_json_format(decoded[world_id]) == to_json_format({'world_id': world_id, **world})
+        for world_id, world in data.items())
+
+
+def convert(source=WORLD_FILE, target=SNAPSHOT_FILE):
+    """Перевести world_data.json в двоичный снимок и проверить его"""
+    with open(source, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    start = time.perf_counter()
+    raw = encode_snapshot(data)
+    encode_time = time.perf_counter() - start
+
+    if not verify_snapshot(data, raw):
+        raise ValueError("Снимок после чтения не совпадает с исходным")
+
+    start = time.perf_counter()
+    decode_snapshot(raw)
+    decode_time = time.perf_counter() - start
+
+    tmp_path = target + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(raw)
+    os.replace(tmp_path, target)
+
+    return {
+        'worlds': len(data),
+        'source_bytes': os.path.getsize(source),
+        'snapshot_bytes': len(raw),
+        'encode_ms': round(encode_time * 1000, 1),
+        'decode_ms': round(decode_time * 1000, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перевод world_data.json в двоичный снимок")
+    parser.add_argument("source", nargs="?", default=WORLD_FILE)
+    parser.add_argument("target", nargs="?", default=SNAPSHOT_FILE)
+    args = parser.parse_args()
+
+    try:
+        result = convert(args.source, args.target)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    print(f"✅ {args.source} -> {args.target}, проверено")
+    for name, value in result.items():
+        print(f"{name}: {value}")
+
+
+if __name__ == '__main__':
+    main()
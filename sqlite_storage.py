@@ -0,0 +1,146 @@
+import json
+import sqlite3
+import threading
+from config import SQLITE_FILE, CHUNK_SIZE
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS worlds (
+    world_id TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS players (
+    world_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (world_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS players_by_user ON players (user_id);
+CREATE TABLE IF NOT EXISTS blocks (
+    world_id TEXT NOT NULL,
+    chunk_x INTEGER NOT NULL,
+    chunk_y INTEGER NOT NULL,
+    owner TEXT NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    z INTEGER NOT NULL,
+    block TEXT NOT NULL,
+    PRIMARY KEY (world_id, chunk_x, chunk_y, owner, x, y, z)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS blocks_by_owner ON blocks (world_id, owner);
+"""
+
+GLOBAL_OWNER = ""  # owner глобальных изменений (NULL в первичном ключе неудобен)
+
+
+class SqliteStorage:
+    """Хранилище миров в SQLite (WAL)
+
+    При старте читается только список миров. Игроки вместе со своими
+    постройками и глобальные изменения по чанкам подгружаются при первом
+    обращении (GameWorld.get_player / GameWorld.get_block).
+    """
+
+    lazy = True
+
+    def __init__(self, path=SQLITE_FILE):
+        self.path = path
+        # Работает в потоке ввода-вывода менеджера; блокировка - для
+        # редких синхронных подгрузок из потока цикла событий. Базу могут
+        # открыть несколько процессов-шардов, запись ждёт до timeout секунд
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.lock = threading.Lock()
+
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(SCHEMA)
+
+    def load(self):
+        """Только идентификаторы миров, содержимое грузится лениво"""
+        with self.lock:
+            rows = self.conn.execute("SELECT world_id FROM worlds").fetchall()
+        return {world_id: {'world_id': world_id} for (world_id,) in rows}
+
+    def find_player_world(self, user_id):
+        """Мир, в котором сохранён игрок"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT world_id FROM players WHERE user_id = ? LIMIT 1", (user_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def load_player(self, world_id, user_id):
+        """Данные игрока в формате Player.to_dict() или None"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT data FROM players WHERE world_id = ? AND user_id = ?",
+                (world_id, user_id)
+            ).fetchone()
+            if not row:
+                return None
+
+            blocks = self.conn.execute(
+                "SELECT x, y, z, block FROM blocks WHERE world_id = ? AND owner = ?",
+                (world_id, user_id)
+            ).fetchall()
+
+        data = json.loads(row[0])
+        data['modified_blocks'] = {f"{x},{y},{z}": block for x, y, z, block in blocks}
+        return data
+
+    def load_chunk(self, world_id, chunk_x, chunk_y):
+        """Глобальные изменения чанка: {"x,y,z": блок}"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT x, y, z, block FROM blocks "
+                "WHERE world_id = ? AND chunk_x = ? AND chunk_y = ? AND owner = ?",
+                (world_id, chunk_x, chunk_y, GLOBAL_OWNER)
+            ).fetchall()
+        return {f"{x},{y},{z}": block for x, y, z, block in rows}
+
+    def wants_snapshot(self):
+        """Полные снимки не нужны, изменения пишутся прямо в таблицы"""
+        return False
+
+    def write(self, records, snapshot=None):
+        """Применить пачку записей WorldSaver одной транзакцией
+
+        Возвращает примерный объём данных в байтах (без служебных
+        структур SQLite).
+        """
+        written = 0
+        worlds = []
+        players = []
+        set_blocks = []
+        deleted_blocks = []
+
+        for record in records:
+            world_id = record['w']
+            if 's' in record:
+                data = json.dumps(record['s'], ensure_ascii=False)
+                players.append((world_id, record['p'], data))
+                written += len(data.encode('utf-8'))
+            elif 'k' in record:
+                x, y, z = map(int, record['k'].split(','))
+                owner = record['p'] if record['p'] is not None else GLOBAL_OWNER
+                row = (world_id, x // CHUNK_SIZE, y // CHUNK_SIZE, owner, x, y, z)
+                if record['b'] is None:
+                    deleted_blocks.append(row)
+                else:
+                    set_blocks.append(row + (record['b'],))
+                    written += len(record['b'].encode('utf-8'))
+            else:
+                worlds.append((world_id,))
+
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO worlds VALUES (?)", worlds)
+            self.conn.executemany("INSERT OR REPLACE INTO players VALUES (?, ?, ?)", players)
+            self.conn.executemany(
+                "DELETE FROM blocks WHERE world_id = ? AND chunk_x = ? AND chunk_y = ? "
+                "AND owner = ? AND x = ? AND y = ? AND z = ?", deleted_blocks)
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO blocks VALUES (?, ?, ?, ?, ?, ?, ?, ?)", set_blocks)
+        return written
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
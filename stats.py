@@ -0,0 +1,213 @@
+import asyncio
+import bisect
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from config import STATS_FILE, STATS_PORT, STATS_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Верхние границы корзин гистограмм, секунды
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+           0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PROMETHEUS_PREFIX = "minebot_"
+
+
+class Stats:
+    """Счётчики и гистограммы времени горячего пути
+
+    Один экземпляр на процесс (stats ниже). Запись идёт и из потока
+    ввода-вывода, поэтому под блокировкой. Источники (add_source) -
+    объекты со своими счётчиками, их значения читаются при снимке.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timers = {}  # имя: [количество по корзинам (+ переполнение), сумма]
+        self.counters = {}  # имя: число
+        self.sources = {}  # префикс: функция -> {имя: значение}
+
+    def observe(self, name, seconds):
+        """Добавить замер времени"""
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = [[0] * (len(BUCKETS) + 1), 0.0]
+            timer[0][bisect.bisect_left(BUCKETS, seconds)] += 1
+            timer[1] += seconds
+
+    @contextmanager
+    def timer(self, name):
+        """Замерить время блока with"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def reset(self):
+        """Обнулить замеры и счётчики (источники остаются)"""
+        with self.lock:
+            self.timers.clear()
+            self.counters.clear()
+
+    def add_source(self, prefix, counters):
+        """Подключить счётчики объекта: counters() -> {имя: значение}"""
+        self.sources[prefix] = counters
+
+    def snapshot(self, gauges=None):
+        """Снимок в простых данных (его можно передать из шарда)"""
+        with self.lock:
+            data = {
+                'timers': {name: [list(buckets), total] for name, (buckets, total) in self.timers.items()},
+                'counters': dict(self.counters),
+                'gauges': {}
+            }
+
+        for prefix, counters in list(self.sources.items()):
+            for name, value in counters().items():
+                data['gauges'][f"{prefix}_{name}"] = value
+        data['gauges'].update(gauges or {})
+        return data
+
+
+stats = Stats()
+
+
+def merge_snapshots(snapshots):
+    """Сложить снимки нескольких процессов"""
+    merged = {'timers': {}, 'counters': {}, 'gauges': {}}
+    for snapshot in snapshots:
+        for name, (buckets, total) in snapshot['timers'].items():
+            timer = merged['timers'].setdefault(name, [[0] * len(buckets), 0.0])
+            timer[0] = [a + b for a, b in zip(timer[0], buckets)]
+            timer[1] += total
+        for kind in ('counters', 'gauges'):
+            for name, value in snapshot[kind].items():
+                merged[kind][name] = merged[kind].get(name, 0) + value
+    return merged
+
+
+def quantile(buckets, q):
+    """Оценка квантиля по корзинам (линейно внутри корзины), секунды"""
+    count = sum(buckets)
+    if not count:
+        return 0.0
+
+    rank = q * count
+    seen = 0
+    for index, in_bucket in enumerate(buckets):
+        if in_bucket and seen + in_bucket >= rank:
+            low = BUCKETS[index - 1] if index > 0 else 0.0
+            high = BUCKETS[index] if index < len(BUCKETS) else BUCKETS[-1]
+            return low + (high - low) * (rank - seen) / in_bucket
+        seen += in_bucket
+    return BUCKETS[-1]
+
+
+def format_text(snapshot):
+    """Снимок для /stats"""
+    lines = ["⏱ Время, мс (кол-во p50 p99 ср.)"]
+    for name, (buckets, total) in sorted(snapshot['timers'].items()):
+        count = sum(buckets)
+        lines.append(f"{name}: {count} {quantile(buckets, 0.5) * 1000:.2f} "
+                     f"{quantile(buckets, 0.99) * 1000:.2f} {total / count * 1000 if count else 0:.2f}")
+
+    lines.append("\n🔢 Счётчики")
+    for name, value in sorted({**snapshot['counters'], **snapshot['gauges']}.items()):
+        lines.append(f"{name}: {value}")
+    return "\n".join(lines)
+
+
+def format_prometheus(snapshot):
+    """Снимок в текстовом формате Prometheus"""
+    lines = []
+    for name, (buckets, total) in sorted(snapshot['timers'].items()):
+        metric = f"{PROMETHEUS_PREFIX}{name}_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        cumulative = 0
+        for bound, in_bucket in zip(BUCKETS, buckets):
+            cumulative += in_bucket
+            lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{metric}_bucket{{le="+Inf"}} {sum(buckets)}')
+        lines.append(f"{metric}_sum {total}")
+        lines.append(f"{metric}_count {sum(buckets)}")
+
+    for name, value in sorted(snapshot['counters'].items()):
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}{name}_total counter")
+        lines.append(f"{PROMETHEUS_PREFIX}{name}_total {value}")
+
+    for name, value in sorted(snapshot['gauges'].items()):
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}{name} gauge")
+        lines.append(f"{PROMETHEUS_PREFIX}{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class StatsExporter:
+    """Выгрузка метрик для Prometheus: в файл и/или по HTTP (/metrics)
+
+    collect - корутина, возвращающая снимок (game.stats). Файл пишется
+    раз в STATS_INTERVAL секунд, HTTP отвечает свежим снимком; порт
+    слушается только если установлен aiohttp.
+    """
+
+    def __init__(self, collect, path=STATS_FILE, port=STATS_PORT, interval=STATS_INTERVAL):
+        self.collect = collect
+        self.path = path
+        self.port = port
+        self.interval = interval
+        self._task = None
+        self._runner = None
+
+    async def start(self):
+        if self.path:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+        if self.port:
+            try:
+                from aiohttp import web
+            except ImportError:
+                logger.warning("STATS_PORT задан, но aiohttp не установлен")
+                return
+
+            app = web.Application()
+            app.router.add_get("/metrics", self._handle_metrics)
+            self._runner = web.AppRunner(app)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, "127.0.0.1", self.port).start()
+
+    async def _handle_metrics(self, request):
+        from aiohttp import web
+        text = format_prometheus(await self.collect())
+        return web.Response(text=text, content_type="text/plain")
+
+    def _write(self, text):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, self.path)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                text = format_prometheus(await self.collect())
+                await loop.run_in_executor(None, self._write, text)
+            except Exception as e:
+                logger.error(f"Ошибка выгрузки метрик: {e}")
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,77 @@
+"""Проверки выгрузки неактивных игроков (GameWorld.evict_idle)
+
+    python -m pytest -q test_eviction.py
+"""
+import asyncio
+
+import pytest
+
+from multiplayer import MultiplayerManager
+from persistence import JournalStorage
+from sqlite_storage import SqliteStorage
+
+
+def journal_storage(tmp_path):
+    return JournalStorage(str(tmp_path / "world.mbs"), str(tmp_path / "journal.jsonl"),
+                          legacy_path=str(tmp_path / "world.json"),
+                          region_dir=str(tmp_path / "regions"))
+
+
+def sqlite_storage(tmp_path):
+    return SqliteStorage(str(tmp_path / "world.db"))
+
+
+@pytest.mark.parametrize("make_storage", [journal_storage, sqlite_storage])
+def test_evicted_player_comes_back_unchanged(tmp_path, make_storage):
+    async def run():
+        multiplayer = MultiplayerManager(storage=make_storage(tmp_path))
+        await multiplayer.ensure_loaded()
+        world, player = multiplayer.join_world("1", "p1")
+        world.set_player_position("1", 5, -6, 21)
+        player.add_to_inventory("камень", 3)
+        world.set_block(7, 7, 7, "земля", "1")
+        before = world.to_dict()['players']["1"]
+
+        # С несохранёнными изменениями игрок остаётся в памяти
+        assert multiplayer.evict_idle_players(timeout=-1) == 0
+        await multiplayer.saver.flush_async()
+        assert multiplayer.evict_idle_players(timeout=-1) == 1
+        assert "1" not in world.players
+
+        world = await multiplayer.activate_player("1")
+        assert world.get_player("1").to_dict() == before
+        multiplayer.close()
+
+    asyncio.run(run())
+
+
+def test_player_with_failed_write_is_not_evicted(tmp_path):
+    async def run():
+        multiplayer = MultiplayerManager(storage=sqlite_storage(tmp_path))
+        await multiplayer.ensure_loaded()
+        world, _ = multiplayer.join_world("1", "p1")
+        world.set_player_position("1", 100, 100, 21)
+        await multiplayer.saver.flush_async()
+
+        # Запись не удалась: пометки уже сняты, записи ждут повтора
+        world.set_player_position("1", -20, -21, 21)
+        write = multiplayer.storage.write
+
+        def failing_write(records, snapshot=None):
+            raise OSError("диск переполнен")
+
+        multiplayer.storage.write = failing_write
+        with pytest.raises(OSError):
+            await multiplayer.saver.flush_async()
+        assert not world.changed_players
+        assert multiplayer.evict_idle_players(timeout=-1) == 0
+
+        # После повтора игрока можно выгрузить, и он вернётся новым
+        multiplayer.storage.write = write
+        await multiplayer.saver.flush_async()
+        assert multiplayer.evict_idle_players(timeout=-1) == 1
+        world = await multiplayer.activate_player("1")
+        assert world.get_player("1").position == (-20, -21, 21)
+        multiplayer.close()
+
+    asyncio.run(run())
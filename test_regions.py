@@ -0,0 +1,117 @@
+"""Проверки файлов регионов (regions.py) и их сжатия из журнала
+
+    python -m pytest -q test_regions.py
+"""
+import os
+
+from config import AIR_HEIGHT, CHUNK_SIZE, REGION_SIZE
+from blocks import get_registry
+from chunks import ChunkStore
+from multiplayer import MultiplayerManager
+from persistence import JournalStorage
+from regions import RegionStore, WorldRegions, write_regions
+
+SKY = AIR_HEIGHT + 5  # Над землёй генератор даёт воздух
+
+
+def make_storage(tmp_path):
+    # compact_size=-1: каждая запись сжимает журнал в снимок и регионы
+    return JournalStorage(str(tmp_path / "world.mbs"), str(tmp_path / "journal.jsonl"),
+                          compact_size=-1, legacy_path=str(tmp_path / "world.json"),
+                          region_dir=str(tmp_path / "regions"), region_files=True)
+
+
+def make_store(blocks):
+    store = ChunkStore()
+    for (x, y, z), name in blocks.items():
+        store.set(x, y, z, get_registry().id_of(name))
+    return store
+
+
+def read_back(directory):
+    regions = WorldRegions(directory)
+    names = get_registry().names
+    result = {}
+    for (chunk_x, chunk_y, chunk_z), chunk, count in regions.all_chunks():
+        store = ChunkStore()
+        store.chunks[(chunk_x, chunk_y, chunk_z)] = bytearray(chunk)
+        store.counts[(chunk_x, chunk_y, chunk_z)] = count
+        result.update({(x, y, z): names[block_id] for x, y, z, block_id in store.items()})
+    return result
+
+
+def test_round_trip_with_negative_chunks(tmp_path):
+    blocks = {(1, 2, 3): "камень", (-1, -1, -1): "земля",
+              (-CHUNK_SIZE * REGION_SIZE - 5, 7, SKY): "ствол", (500, -900, -40): "уголь"}
+    store = make_store(blocks)
+    directory = str(tmp_path / "w")
+    assert write_regions(directory, store.chunks, store.counts) > 0
+    assert read_back(directory) == blocks
+
+    # Чтение отдельных чанков через RegionStore
+    region_store = RegionStore(WorldRegions(directory))
+    for (x, y, z), name in blocks.items():
+        assert get_registry().names[region_store.get(x, y, z)] == name
+
+
+def test_incremental_write_drops_emptied_chunk(tmp_path):
+    directory = str(tmp_path / "w")
+    store = make_store({(1, 1, SKY): "камень", (100, 1, SKY): "земля"})
+    write_regions(directory, store.chunks, store.counts)
+
+    # RegionStore помнит опустевший чанк, пока его не запишут
+    region_store = RegionStore(WorldRegions(directory))
+    assert region_store.remove(1, 1, SKY)
+    assert region_store.get(1, 1, SKY) == 0
+    write_regions(directory, region_store.chunks, region_store.counts)
+    assert read_back(directory) == {(100, 1, SKY): "земля"}
+
+
+def test_complete_write_drops_missing_sections_and_files(tmp_path):
+    directory = str(tmp_path / "w")
+    far = CHUNK_SIZE * REGION_SIZE * 3
+    store = make_store({(1, 1, SKY): "камень", (2, 40, SKY): "земля", (far, far, SKY): "ствол"})
+    write_regions(directory, store.chunks, store.counts)
+    assert len(os.listdir(directory)) == 2
+
+    # Обычный ChunkStore удаляет ключ опустевшего чанка
+    store.remove(1, 1, SKY)
+    store.remove(far, far, SKY)
+    write_regions(directory, store.chunks, store.counts, complete=True)
+    assert read_back(directory) == {(2, 40, SKY): "земля"}
+    assert len(os.listdir(directory)) == 1
+
+
+def test_removed_block_stays_removed_after_restart(tmp_path):
+    multiplayer = MultiplayerManager(storage=make_storage(tmp_path))
+    multiplayer.load_worlds()
+    world = multiplayer.create_world("w")
+    world.set_block(1, 2, SKY, "камень")
+    world.set_block(40, 2, SKY, "земля")
+    multiplayer.save_worlds()
+    multiplayer.save_worlds()
+
+    # Живой мир до перезапуска хранит изменения в обычном ChunkStore
+    assert not isinstance(world.global_blocks, RegionStore)
+    world.set_block(1, 2, SKY, "воздух")
+    multiplayer.save_worlds()
+    multiplayer.save_worlds()
+    assert world.get_block(1, 2, SKY) == "воздух"
+    multiplayer.close()
+
+    reloaded = MultiplayerManager(storage=make_storage(tmp_path))
+    reloaded.load_worlds()
+    world = reloaded.get_world("w")
+    assert isinstance(world.global_blocks, RegionStore)
+    assert world.get_block(1, 2, SKY) == "воздух"
+    assert world.get_block(40, 2, SKY) == "земля"
+
+    # После перезапуска опустевший чанк - в RegionStore
+    world.set_block(40, 2, SKY, "воздух")
+    reloaded.save_worlds()
+    reloaded.close()
+
+    restarted = MultiplayerManager(storage=make_storage(tmp_path))
+    restarted.load_worlds()
+    assert restarted.get_world("w").get_block(40, 2, SKY) == "воздух"
+    restarted.close()
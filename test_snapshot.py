@@ -0,0 +1,128 @@
+"""Проверки двоичного снимка (snapshot.py): запись и чтение обратно
+
+    python -m pytest -q test_snapshot.py
+"""
+import pytest
+
+import chunks
+import snapshot
+from blocks import BlockRegistry, get_registry
+from chunks import ChunkStore, CHUNK_SIZE
+from snapshot import (SPARSE_LIMIT, encode_player, decode_player, encode_snapshot,
+                      decode_snapshot, to_json_format, verify_snapshot)
+
+
+def make_world(world_id, blocks, players=None):
+    return {'world_id': world_id, 'global_modified_blocks': blocks, 'players': players or {}}
+
+
+def make_player(user_id, blocks=None, position=(0, 0, 21)):
+    return {
+        'user_id': user_id,
+        'username': f"p{user_id}",
+        'position': list(position),
+        'health': 7,
+        'inventory': {"камень": 3, "ствол": 1},
+        'modified_blocks': blocks or {}
+    }
+
+
+def dense_chunk(chunk_x, chunk_y, chunk_z, names):
+    """Почти заполненный чанк: больше SPARSE_LIMIT блоков"""
+    blocks = {}
+    for z in range(CHUNK_SIZE):
+        for y in range(CHUNK_SIZE):
+            for x in range(0, CHUNK_SIZE, 2):
+                blocks[f"{chunk_x * CHUNK_SIZE + x},{chunk_y * CHUNK_SIZE + y},"
+                       f"{chunk_z * CHUNK_SIZE + z}"] = names[(x + y + z) % len(names)]
+    assert len(blocks) > SPARSE_LIMIT
+    return blocks
+
+
+def round_trip(data):
+    decoded = decode_snapshot(encode_snapshot(data))
+    assert decoded.keys() == data.keys()
+    for world_id, world in data.items():
+        assert to_json_format(decoded[world_id]) == to_json_format(world)
+    return decoded
+
+
+def test_negative_coordinates():
+    blocks = {
+        "-1,-1,-1": "камень",
+        "-16,-17,-40": "земля",
+        "-100000,5,-3": "ствол",
+        "15,-16,0": "листва",
+        "0,0,0": "уголь",
+        "2147483647,-2147483648,7": "трава"
+    }
+    player = make_player("1", {"-5,-5,20": "земля", "-33,64,-1": "камень"}, position=(-7, -9, 21))
+    round_trip({"w": make_world("w", blocks, {"1": player})})
+
+
+def test_dense_chunk():
+    blocks = dense_chunk(-2, 3, -1, ["камень", "земля", "уголь"])
+    blocks.update({"100,100,100": "ствол"})  # И разреженный чанк рядом
+    decoded = round_trip({"w": make_world("w", blocks)})
+
+    store = decoded["w"]['global_modified_blocks']
+    assert isinstance(store, ChunkStore)
+    assert store.counts[(-2, 3, -1)] == len(blocks) - 1
+
+
+def test_unknown_block_remaps_palette(monkeypatch):
+    # Снимок записан другой палитрой: новый блок первым, остальные наоборот
+    items = get_registry().items_data
+    old_items = {**items, "блоки": {"блок из будущего": {"прочность": 1},
+                                    **dict(reversed(list(items["блоки"].items())))}}
+    old_registry = BlockRegistry(old_items)
+    assert old_registry.names[1:] != get_registry().names[1:len(old_registry.names)]
+
+    blocks = dense_chunk(0, 0, 0, ["блок из будущего", "камень"])
+    blocks.update({"-20,-20,-20": "блок из будущего", "40,1,1": "земля"})
+    player = make_player("1", {"-3,2,1": "блок из будущего"})
+    offline = make_player("2", {"9,9,9": "ствол"})
+
+    monkeypatch.setattr(snapshot, "get_registry", lambda: old_registry)
+    monkeypatch.setattr(chunks, "get_registry", lambda: old_registry)
+    raw = encode_snapshot({"w": make_world("w", blocks, {"1": player, "2": encode_player(offline)})})
+    monkeypatch.undo()
+
+    decoded = decode_snapshot(raw)
+    world = to_json_format(decoded["w"])
+    assert world['global_modified_blocks'] == blocks
+    assert world['players']["1"]['modified_blocks'] == player['modified_blocks']
+    assert world['players']["2"]['modified_blocks'] == offline['modified_blocks']
+    assert "блок из будущего" in get_registry().ids
+
+    # Записи игроков переведены в ID текущей палитры
+    record = decoded["w"]['players']["1"]
+    assert isinstance(record, bytes)
+    assert decode_player(record)['modified_blocks'].to_dict() == player['modified_blocks']
+
+
+def test_offline_player_records():
+    online = make_player("1", {"1,2,3": "камень"})
+    offline = make_player("2", {"-4,5,-6": "ствол"}, position=(-3, 4, 18))
+    record = encode_player(offline)
+    data = {"w": make_world("w", {"0,0,0": "земля"}, {"1": online, "2": record})}
+    decoded = round_trip(data)
+
+    players = decoded["w"]['players']
+    assert players["2"] == record  # Запись выгруженного игрока не разбирается
+    assert isinstance(players["1"], bytes)
+    restored = decode_player(players["2"])
+    assert restored['modified_blocks'].to_dict() == offline['modified_blocks']
+    assert {key: value for key, value in restored.items() if key != 'modified_blocks'} == \
+        {key: value for key, value in offline.items() if key != 'modified_blocks'}
+
+    # Снимок из прочитанных записей совпадает с исходным
+    assert verify_snapshot(data, encode_snapshot(decoded))
+
+
+def test_rejects_foreign_data():
+    raw = encode_snapshot({"w": make_world("w", {})})
+    with pytest.raises(ValueError):
+        decode_snapshot(b"JSON" + raw[4:])
+    with pytest.raises(ValueError):
+        decode_snapshot(raw[:4] + bytes([raw[4] + 1]) + raw[5:])
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import signal
+import sys
+
+try:
+    from aiohttp import web, ClientSession
+except ImportError:  # aiohttp нужен только в режиме webhook
+    web = None
+    ClientSession = None
+
+from telegram import Update
+from stats import stats
+from config import (WEBHOOK_URL, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH,
+                    WEBHOOK_SECRET, WEBHOOK_MAX_PENDING)
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """Приём обновлений Telegram по HTTP (aiohttp)
+    
+    TLS снимает локальный прокси, сервер слушает обычный HTTP на
+    WEBHOOK_HOST:WEBHOOK_PORT. Обновление сразу передаётся приложению,
+    а Telegram получает ответ, не дожидаясь обработки. Если в работе уже
+    max_pending обновлений, сервер отвечает 503: Telegram повторит
+    доставку позже, а балансировщик может отдать запрос другому процессу.
+    
+    Таймер update_parse (разбор Update) есть только в этом режиме.
+    """
+    
+    def __init__(self, application, max_pending=WEBHOOK_MAX_PENDING, secret=WEBHOOK_SECRET):
+        if web is None:
+            raise RuntimeError("Для режима webhook нужен aiohttp: pip install aiohttp")
+        
+        self.application = application
+        self.max_pending = max_pending
+        self.secret = secret
+        self.runner = None
+        
+        # Счётчики
+        self.pending = 0
+        self.accepted = 0
+        self.rejected = 0
+        
+        self.app = web.Application()
+        self.app.router.add_post(WEBHOOK_PATH, self.handle)
+    
+    async def handle(self, request):
+        """POST от Telegram (или от replay)"""
+        if self.secret and request.headers.get(SECRET_HEADER) != self.secret:
+            return web.Response(status=403)
+        
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        
+        # Место занимается до первого await: иначе запросы, ждущие тело,
+        # все проходят проверку выше
+        self.pending += 1
+        try:
+            data = await request.json()
+            # Замер только здесь: при run_polling обновления разбирает сам
+            # PTB внутри get_updates, вместе с ожиданием ответа сервера
+            with stats.timer("update_parse"):
+                update = Update.de_json(data, self.application.bot)
+        except Exception as e:
+            self.pending -= 1
+            logger.warning(f"Некорректное обновление: {e}")
+            return web.Response(status=400)
+        
+        self.accepted += 1
+        self.application.create_task(self._process(update), update=update)
+        return web.Response()
+    
+    def counters(self):
+        """Счётчики для статистики"""
+        return {'pending': self.pending, 'accepted': self.accepted, 'rejected': self.rejected}
+    
+    async def _process(self, update):
+        try:
+            # Тот же путь, что у обновлений из update_queue при run_polling:
+            # семафор concurrent_updates, затем обработчики
+            await self.application.update_processor.process_update(
+                update, self.application.process_update(update))
+        finally:
+            self.pending -= 1
+    
+    async def start(self, host=WEBHOOK_HOST, port=WEBHOOK_PORT):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        logger.info(f"Webhook слушает http://{host}:{port}{WEBHOOK_PATH}")
+    
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+async def serve(application, url=WEBHOOK_URL):
+    """Жизненный цикл приложения в режиме webhook (как в run_polling)"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    
+    server = WebhookServer(application)
+    stats.add_source("webhook", server.counters)
+    
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    
+    try:
+        # Адрес регистрирует один процесс; пустой WEBHOOK_URL - для процессов
+        # за балансировщиком и локальной проверки через replay
+        if url:
+            await application.bot.set_webhook(
+                url + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET or None,
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=True
+            )
+        
+        await server.start()
+        await stop.wait()
+    finally:
+        await server.stop()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+def run_webhook(application):
+    """Запустить бота в режиме webhook"""
+    asyncio.run(serve(application))
+
+async def replay(path, url, secret=WEBHOOK_SECRET, concurrency=1):
+    """Отправить записанные обновления (JSON по строке) на webhook
+    
+    Локальная замена Telegram для проверки приёма. Возвращает
+    {HTTP-статус: количество}.
+    """
+    statuses = {}
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers[SECRET_HEADER] = secret
+    
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = [line for line in f if line.strip()]
+    
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def post(session, body):
+        async with semaphore:
+            async with session.post(url, data=body.encode('utf-8'), headers=headers) as resp:
+                statuses[resp.status] = statuses.get(resp.status, 0) + 1
+    
+    async with ClientSession() as session:
+        await asyncio.gather(*(post(session, line) for line in lines))
+    return statuses
+
+if __name__ == '__main__':
+    # python webhook.py updates.jsonl [url] [параллельность]
+    if len(sys.argv) < 2:
+        print("Использование: python webhook.py updates.jsonl [url] [параллельность]")
+        sys.exit(1)
+    
+    target = sys.argv[2] if len(sys.argv) > 2 else f"http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}"
+    parallel = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    print(asyncio.run(replay(sys.argv[1], target, concurrency=parallel)))
@@ -1,123 +1,37 @@
-import json
-import random
-from config import VIEW_SIZE, AIR_HEIGHT, GRASS_HEIGHT, WORLD_SEED
+from config import VIEW_SIZE, CHUNK_SIZE
 from player import Player
-
-class WorldGenerator:
-    """Генератор мира"""
-    
-    def __init__(self, items_file="items.json"):
-        with open(items_file, 'r', encoding='utf-8') as f:
-            self.items_data = json.load(f)
-        
-        self.tree_positions = {}
-        self.mushroom_positions = {}
-        self.generated_areas = set()
-        
-    def _get_seed(self, x, y, z=0):
-        """Сид для детерминированной генерации"""
-        return hash(f"{x}_{y}_{z}_{WORLD_SEED}") % 1000000
-    
-    def generate_area(self, center_x, center_y):
-        """Генерация области (деревья и грибы)"""
-        area_key = f"{center_x//50}_{center_y//50}"
-        
-        if area_key in self.generated_areas:
-            return
-            
-        self.generated_areas.add(area_key)
-        radius = 25
-        
-        for x in range(center_x - radius, center_x + radius + 1):
-            for y in range(center_y - radius, center_y + radius + 1):
-                seed = self._get_seed(x, y)
-                random.seed(seed)
-                
-                tree_key = f"{x},{y}"
-                # Деревья (30%)
-                if random.random() < 0.3:
-                    self.tree_positions[tree_key] = True
-                # Грибы (20%)
-                if random.random() < 0.2:
-                    self.mushroom_positions[tree_key] = True
-    
-    def get_block_type(self, x, y, z):
-        """Определить тип блока на позиции"""
-        # ВОЗДУХ (верхние AIR_HEIGHT блоков)
-        if z > AIR_HEIGHT:
-            tree_key = f"{x},{y}"
-            
-            # ДЕРЕВЬЯ
-            if tree_key in self.tree_positions:
-                if z == AIR_HEIGHT + 1:  # Нижняя листва
-                    return "листва"
-                elif z == AIR_HEIGHT + 2 or z == AIR_HEIGHT + 3:  # Ствол
-                    return "ствол"
-                elif z == AIR_HEIGHT + 4:  # Верхняя листва
-                    return "листва"
-            
-            # ГРИБЫ
-            if z == AIR_HEIGHT + 1 and tree_key in self.mushroom_positions:
-                return "гриб поганка"
-            
-            return "воздух"
-        
-        # ТРАВА (ровно на высоте AIR_HEIGHT)
-        elif z == AIR_HEIGHT:
-            return "трава"
-        
-        # ЗЕМЛЯ (GRASS_HEIGHT блоков под травой)
-        elif AIR_HEIGHT - GRASS_HEIGHT < z < AIR_HEIGHT:
-            return "земля"
-        
-        # КАМЕНЬ и РУДЫ (ниже)
-        else:
-            depth = AIR_HEIGHT - z - GRASS_HEIGHT
-            
-            seed = self._get_seed(x * 1000 + y, z)
-            random.seed(seed)
-            rand_val = random.random()
-            
-            # Руды по глубине
-            if depth >= 25 and depth <= 30:  # Алмазы
-                if rand_val < 0.05:
-                    return "алмазная руда"
-            
-            if depth >= 15 and depth <= 25:  # Золото
-                if rand_val < 0.07:
-                    return "золотая руда"
-            
-            if depth >= 8 and depth <= 15:  # Железо
-                if rand_val < 0.1:
-                    return "железная руда"
-            
-            if depth >= 3 and depth <= 15:  # Уголь (чаще)
-                if rand_val < 0.15:
-                    return "уголь"
-            
-            # Камень (основной блок)
-            return "камень"
-    
-    def get_block_data(self, block_type):
-        """Получить данные блока"""
-        return self.items_data.get("блоки", {}).get(block_type, {})
+from world_generator import WorldGenerator
+from blocks import EMPTY, get_registry
+from chunks import ChunkStore, parse_key
+from snapshot import encode_player, decode_player, to_json_format
 
 class GameWorld:
     """Игровой мир"""
     
-    def __init__(self, world_id="default"):
+    def __init__(self, world_id="default", loader=None, generator=None):
         self.world_id = world_id
-        self.generator = WorldGenerator()
-        self.players = {}  # user_id: Player
-        self.global_modified_blocks = {}
-        
-        # Генерируем стартовую область
-        self.generator.generate_area(0, 0)
+        # Рельеф зависит только от WORLD_SEED, генератор (и его кэш) можно делить между мирами
+        self.generator = generator or WorldGenerator()
+        self.players = {}  # user_id: Player (активные, в памяти)
+        # Неактивные игроки без ленивого хранилища: user_id: запись snapshot.encode_player
+        self.offline_players = {}
+        self.player_positions = {}  # (x, y, z): {user_id} - индекс игроков по клеткам
+        self.blocks = get_registry()
+        self.global_blocks = ChunkStore()  # Строения, общие для всех игроков
+        
+        # Ленивая подгрузка игроков и чанков из хранилища (см. SqliteStorage)
+        self.loader = loader
+        self.loaded_chunks = set()  # (chunk_x, chunk_y)
+        
+        # Изменения с последнего сохранения (см. persistence.WorldSaver)
+        self.changed_players = set()  # user_id
+        self.changed_blocks = set()  # (user_id или None, (x, y, z))
     
-    def add_player(self, user_id, username, spawn_x=0, spawn_y=0):
-        """Добавить игрока"""
-        if str(user_id) in self.players:
-            return self.players[str(user_id)]
+    def add_player(self, user_id, username, spawn_x=0, spawn_y=0, saved=True):
+        """Добавить игрока (saved=False - в хранилище его точно нет)"""
+        existing = self.get_player(user_id) if saved else self.players.get(str(user_id))
+        if existing:
+            return existing
         
         # Случайный спавн в радиусе 50 блоков
         import random
@@ -126,137 +40,296 @@ class GameWorld:
         
         player = Player(user_id, username, spawn_x, spawn_y)
         self.players[str(user_id)] = player
-        
-        # Генерируем область вокруг спавна
-        self.generator.generate_area(spawn_x, spawn_y)
+        self._index_player(player)
+        self.mark_changed(player_id=user_id)
         
         return player
     
+    def mark_changed(self, player_id=None, block_key=None):
+        """Пометить несохранённое состояние игрока или блок
+        
+        С block_key=(x, y, z) помечается блок игрока player_id (None -
+        глобальный), без него - состояние самого игрока.
+        """
+        owner = str(player_id) if player_id is not None else None
+        if block_key is not None:
+            self.changed_blocks.add((owner, block_key))
+        elif owner is not None:
+            self.changed_players.add(owner)
+    
+    def pop_changes(self):
+        """Забрать накопленные изменения (игроки, (владелец, ключ) блоков)"""
+        players, self.changed_players = self.changed_players, set()
+        blocks, self.changed_blocks = self.changed_blocks, set()
+        return players, blocks
+    
     def get_player(self, user_id):
-        """Получить игрока"""
-        return self.players.get(str(user_id))
+        """Получить игрока (неактивный подгружается обратно в память)"""
+        player = self.players.get(str(user_id))
+        if player is None:
+            data = self.offline_players.pop(str(user_id), None)
+            if data is not None:
+                player = self.add_loaded_player(str(user_id), decode_player(data))
+            elif self.loader:
+                player = self._load_player(str(user_id))
+        return player
+    
+    def player_ids(self):
+        """Все игроки мира, и активные, и выгруженные (кроме ленивого хранилища)"""
+        return list(self.players) + list(self.offline_players)
+    
+    def evict_idle(self, cutoff, unsaved=()):
+        """Выгрузить игроков, неактивных с момента cutoff (time.monotonic)
+        
+        Игроки с несохранёнными изменениями (и unsaved - чья запись ещё
+        не закончилась или ждёт повтора) остаются в памяти до записи.
+        Без ленивого хранилища выгруженный игрок хранится компактной записью
+        (той же, что в снимке).
+        """
+        pending = self.changed_players | {owner for owner, _ in self.changed_blocks} | set(unsaved)
+        evicted = 0
+        for pid, player in list(self.players.items()):
+            if player.last_active >= cutoff or pid in pending:
+                continue
+            
+            self._unindex_player(player)
+            del self.players[pid]
+            if not self.loader:
+                self.offline_players[pid] = encode_player(
+                    {**player.state_to_dict(), 'modified_blocks': player.modified_blocks})
+            evicted += 1
+        return evicted
+    
+    def _load_player(self, player_id):
+        """Подгрузить игрока из хранилища (синхронно)"""
+        player_data = self.loader.load_player(self.world_id, player_id)
+        if not player_data:
+            return None
+        return self.add_loaded_player(player_id, player_data)
+    
+    def add_loaded_player(self, player_id, player_data):
+        """Добавить игрока, прочитанного из хранилища"""
+        if player_id in self.players:
+            # Пока шло чтение, игрок уже появился в памяти - он новее
+            return self.players[player_id]
+        
+        player = self._player_from_dict(player_id, player_data)
+        self.players[player_id] = player
+        self._index_player(player)
+        return player
+    
+    def _player_from_dict(self, player_id, player_data):
+        """Собрать игрока из сохранённых данных"""
+        player = Player(
+            player_data.get('user_id', player_id),
+            player_data.get('username', 'Игрок')
+        )
+        player.load_from_dict(player_data)
+        return player
+    
+    def _index_player(self, player):
+        """Добавить игрока в индекс позиций"""
+        self.player_positions.setdefault(player.position, set()).add(player.user_id)
+    
+    def _unindex_player(self, player):
+        """Убрать игрока из индекса позиций"""
+        pos = player.position
+        ids = self.player_positions.get(pos)
+        if ids:
+            ids.discard(player.user_id)
+            if not ids:
+                del self.player_positions[pos]
+    
+    def set_player_position(self, player_id, x, y, z):
+        """Поставить игрока в клетку (движение, телепорт, респаун)"""
+        player = self.get_player(player_id)
+        if not player:
+            return False
+        
+        self._unindex_player(player)
+        player.position = (x, y, z)
+        self._index_player(player)
+        self.mark_changed(player_id=player_id)
+        return True
+    
+    def missing_chunks(self, x, y, radius):
+        """Ещё не подгруженные чанки в квадрате radius вокруг (x, y)"""
+        return [
+            (chunk_x, chunk_y)
+            for chunk_y in range((y - radius) // CHUNK_SIZE, (y + radius) // CHUNK_SIZE + 1)
+            for chunk_x in range((x - radius) // CHUNK_SIZE, (x + radius) // CHUNK_SIZE + 1)
+            if (chunk_x, chunk_y) not in self.loaded_chunks
+        ]
+    
+    def chunks_ready(self, x, y, radius):
+        """Подгружены ли чанки вокруг (x, y) (без ленивого хранилища - всегда)"""
+        return not self.loader or not self.missing_chunks(x, y, radius)
+    
+    def _ensure_chunk(self, x, y):
+        """Подгрузить глобальные изменения чанка при первом обращении"""
+        chunk = (x // CHUNK_SIZE, y // CHUNK_SIZE)
+        if chunk not in self.loaded_chunks:
+            self.apply_chunk(chunk, self.loader.load_chunk(self.world_id, *chunk))
+    
+    def apply_chunk(self, chunk, edits):
+        """Принять глобальные изменения чанка, прочитанные из хранилища"""
+        if chunk in self.loaded_chunks:
+            return
+        
+        self.loaded_chunks.add(chunk)
+        for key, block in edits.items():
+            x, y, z = parse_key(key)
+            # Несохранённые изменения в памяти новее хранилища
+            if self.global_blocks.get(x, y, z) == EMPTY:
+                self.global_blocks.set(x, y, z, self.blocks.id_of(block))
     
     def get_block(self, x, y, z, player_id=None):
         """Получить блок с учетом изменений"""
-        key = f"{x},{y},{z}"
+        return self.blocks.names[self.get_block_id(x, y, z, player_id)]
+    
+    def get_block_id(self, x, y, z, player_id=None):
+        """ID блока с учетом изменений (палитра blocks.py)"""
+        if self.loader:
+            self._ensure_chunk(x, y)
         
         # 1. Проверяем глобальные изменения (строения всех игроков)
-        if key in self.global_modified_blocks:
-            return self.global_modified_blocks[key]
+        block_id = self.global_blocks.get(x, y, z)
         
         # 2. Проверяем изменения конкретного игрока
-        if player_id:
+        if block_id == EMPTY and player_id:
             player = self.get_player(player_id)
-            if player and key in player.modified_blocks:
-                return player.modified_blocks[key]
+            if player:
+                block_id = player.modified_blocks.get(x, y, z)
+        
+        if block_id != EMPTY:
+            return block_id
         
         # 3. Генерация мира
-        return self.generator.get_block_type(x, y, z)
+        return self.generator.get_block_id(x, y, z)
+    
+    def get_edit(self, owner, x, y, z):
+        """Сохраняемое изменение блока (owner None - глобальное) или None"""
+        if owner is None:
+            block_id = self.global_blocks.get(x, y, z)
+        else:
+            player = self.players.get(owner)
+            block_id = player.modified_blocks.get(x, y, z) if player else EMPTY
+        return self.blocks.names[block_id] if block_id != EMPTY else None
     
     def set_block(self, x, y, z, block_type, player_id=None):
         """Установить блок - ИСПРАВЛЕННАЯ ВЕРСИЯ"""
-        key = f"{x},{y},{z}"
+        if self.loader:
+            self._ensure_chunk(x, y)
+        pos = (x, y, z)
         
         if block_type == "воздух":
             # Удаление блока (добыча)
             # Сначала из глобальных
-            if key in self.global_modified_blocks:
-                del self.global_modified_blocks[key]
+            if self.global_blocks.remove(x, y, z):
+                self.mark_changed(block_key=pos)
             
             # Затем у игрока
             if player_id:
                 player = self.get_player(player_id)
-                if player and key in player.modified_blocks:
-                    del player.modified_blocks[key]
+                if player and player.modified_blocks.remove(x, y, z):
+                    self.mark_changed(player_id=player_id, block_key=pos)
         else:
             # Установка блока (строительство)
+            block_id = self.blocks.id_of(block_type)
             if player_id:
                 player = self.get_player(player_id)
                 if player:
-                    player.modified_blocks[key] = block_type
+                    player.modified_blocks.set(x, y, z, block_id)
+                    self.mark_changed(player_id=player_id, block_key=pos)
             else:
-                self.global_modified_blocks[key] = block_type
+                self.global_blocks.set(x, y, z, block_id)
+                self.mark_changed(block_key=pos)
     
     def break_block(self, x, y, z, player_id):
         """Сломать блок и добавить в инвентарь"""
-        block_type = self.get_block(x, y, z, player_id)
+        blocks = self.blocks
+        block_id = self.get_block_id(x, y, z, player_id)
         
-        if block_type == "воздух":
+        if block_id == blocks.air:
             return None
         
         # Проверяем, можно ли ломать этот блок
-        block_data = self.generator.get_block_data(block_type)
-        if not block_data.get("добывается", False):
+        if not blocks.is_minable[block_id]:
             return None
         
         # Ломаем блок
         self.set_block(x, y, z, "воздух", player_id)
         
         # Получаем дроп
-        drop_item = block_data.get("дроп", block_type)
+        drop_item = blocks.names[blocks.drop_id[block_id]]
         
         # Добавляем в инвентарь игрока
         player = self.get_player(player_id)
         if player:
             player.add_to_inventory(drop_item)
+            self.mark_changed(player_id=player_id)
         
         return drop_item
     
     def can_move_to(self, x, y, z, player_id=None):
         """Можно ли переместиться в клетку"""
-        target_block = self.get_block(x, y, z, player_id)
-        block_below = self.get_block(x, y, z - 1, player_id)
-        
-        solid_blocks = ["трава", "земля", "камень", "уголь", 
-                       "железная руда", "золотая руда", "алмазная руда",
-                       "ствол", "листва", "гриб поганка"]
+        is_solid = self.blocks.is_solid
+        target_id = self.get_block_id(x, y, z, player_id)
         
         # Можно стоять на блоке
-        if target_block in solid_blocks:
+        if is_solid[target_id]:
             return True
         
         # Можно идти по воздуху, если есть блок под ногами
-        if target_block == "воздух" and block_below in solid_blocks:
+        if target_id == self.blocks.air and is_solid[self.get_block_id(x, y, z - 1, player_id)]:
             return True
         
         return False
     
     def find_player_at_position(self, x, y, z, exclude_player_id=None):
         """Найти игрока на позиции"""
-        for pid, player in self.players.items():
+        for pid in self.player_positions.get((x, y, z), ()):
             if pid != exclude_player_id:
-                px, py, pz = player.position
-                if px == x and py == y and pz == z:
-                    return player
+                return self.players[pid]
         return None
     
-    def get_view(self, player_id):
-        """Вид вокруг игрока"""
+    def get_view(self, player_id, size=VIEW_SIZE):
+        """Вид вокруг игрока: size строк по size ID блоков (палитра blocks.py)
+        
+        Срез строится целиком: слой генерации, поверх него изменения
+        игрока и глобальные изменения, затем игроки.
+        """
         player = self.get_player(player_id)
         if not player:
             return []
         
         px, py, pz = player.position
-        view = []
-        half = VIEW_SIZE // 2
-        
-        for dy in range(-half, half + 1):
-            row = []
-            for dx in range(-half, half + 1):
-                world_x = px + dx
-                world_y = py + dy
-                
-                # Проверяем, есть ли здесь игрок
-                other_player = self.find_player_at_position(world_x, world_y, pz, player_id)
-                
-                if other_player:
-                    row.append("персонаж")
-                elif dx == 0 and dy == 0:
-                    row.append("персонаж")
-                else:
-                    block = self.get_block(world_x, world_y, pz, player_id)
-                    row.append(block)
-            view.append(row)
+        half = size // 2
+        x0, y0 = px - half, py - half
+        
+        if self.loader:
+            for chunk_y in range(y0 // CHUNK_SIZE, (y0 + size - 1) // CHUNK_SIZE + 1):
+                for chunk_x in range(x0 // CHUNK_SIZE, (x0 + size - 1) // CHUNK_SIZE + 1):
+                    self._ensure_chunk(chunk_x * CHUNK_SIZE, chunk_y * CHUNK_SIZE)
+        
+        view = self.generator.get_layer(x0, y0, size, size, pz)
+        
+        # Глобальные изменения важнее изменений игрока (как в get_block)
+        player.modified_blocks.overlay(view, x0, y0, pz)
+        self.global_blocks.overlay(view, x0, y0, pz)
+        
+        # Игроки: по индексу клеток или по занятым клеткам, что короче
+        person = self.blocks.id_of("персонаж")
+        if len(self.player_positions) < size * size:
+            for ox, oy, oz in self.player_positions:
+                if oz == pz and 0 <= ox - x0 < size and 0 <= oy - y0 < size:
+                    view[oy - y0][ox - x0] = person
+        else:
+            for dy in range(size):
+                for dx in range(size):
+                    if (x0 + dx, y0 + dy, pz) in self.player_positions:
+                        view[dy][dx] = person
+        view[half][half] = person
         
         return view
     
@@ -264,34 +337,42 @@ class GameWorld:
         """Сохранить мир в словарь"""
         return {
             'world_id': self.world_id,
-            'global_modified_blocks': self.global_modified_blocks,
-            'players': {pid: p.to_dict() for pid, p in self.players.items()}
+            'global_modified_blocks': self.global_blocks.to_dict(),
+            'players': {
+                **to_json_format({'players': self.offline_players})['players'],
+                **{pid: p.to_dict() for pid, p in self.players.items()}
+            }
+        }
+    
+    def to_snapshot(self):
+        """Как to_dict, но изменения блоков - копиями ChunkStore
+        
+        Копия чанков быстрее, чем словарь строк, а кодирует её уже
+        поток ввода-вывода (persistence.WorldSaver, snapshot.py).
+        Записи выгруженных игроков неизменяемы и передаются как есть.
+        """
+        return {
+            'world_id': self.world_id,
+            'global_modified_blocks': self.global_blocks.copy(),
+            'players': {
+                **self.offline_players,
+                **{pid: {**p.state_to_dict(), 'modified_blocks': p.modified_blocks.copy()}
+                   for pid, p in self.players.items()}
+            }
         }
     
     def load_from_dict(self, data):
         """Загрузить мир из словаря"""
         self.world_id = data.get('world_id', 'default')
-        self.global_modified_blocks = data.get('global_modified_blocks', {})
+        self.global_blocks = ChunkStore.from_dict(data.get('global_modified_blocks', {}))
         
-        # Загружаем игроков
+        # Игроки подгружаются в память при первом обращении (get_player)
         self.players = {}
-        players_data = data.get('players', {})
-        
-        for pid, player_data in players_data.items():
-            try:
-                player = Player(
-                    player_data.get('user_id', pid),
-                    player_data.get('username', 'Игрок')
-                )
-                player.load_from_dict(player_data)
-                self.players[pid] = player
-            except Exception as e:
-                print(f"Ошибка загрузки игрока {pid}: {e}")
-        
-        # Восстанавливаем генерацию деревьев/грибов для загруженных игроков
-        for player in self.players.values():
-            px, py, _ = player.position
-            self.generator.generate_area(px, py)
+        self.player_positions = {}
+        self.offline_players = {
+            pid: player_data if isinstance(player_data, bytes) else encode_player(player_data)
+            for pid, player_data in data.get('players', {}).items()
+        }
     
     def get_player_position(self, player_id):
         """Получить позицию игрока"""
@@ -309,12 +390,7 @@ class GameWorld:
         new_z = player.position[2] + dz
         
         if self.can_move_to(new_x, new_y, new_z, player_id):
-            player.position = [new_x, new_y, new_z]
-            
-            # Генерируем новую область если вышли далеко
-            if abs(new_x) > 50 or abs(new_y) > 50:
-                self.generator.generate_area(new_x, new_y)
-            
+            self.set_player_position(player_id, new_x, new_y, new_z)
             return True
         
         return False
@@ -1,91 +1,196 @@
-import json
-import random
-from config import AIR_HEIGHT, GRASS_HEIGHT, WORLD_SEED
+from collections import OrderedDict
+from functools import lru_cache
+from config import (AIR_HEIGHT, GRASS_HEIGHT, WORLD_SEED, CHUNK_SIZE,
+                    DECORATION_CACHE_SIZE, TERRAIN_CACHE_SIZE)
+from blocks import get_registry
+from chunks import SHIFT, MASK
+
+MASK64 = (1 << 64) - 1
+
+# Соли, чтобы решения для одной клетки не зависели друг от друга
+SALT_ORE = 1
+SALT_TREE = 2
+SALT_MUSHROOM = 3
+
+
+def _mix64(h):
+    """Финальное перемешивание splitmix64"""
+    h = ((h ^ (h >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    h = ((h ^ (h >> 27)) * 0x94D049BB133111EB) & MASK64
+    return h ^ (h >> 31)
+
+
+_SEED_HASH = _mix64(WORLD_SEED & MASK64)
+
+
+def coord_hash(x, y, z=0, salt=0):
+    """Детерминированный 64-битный хеш координат и WORLD_SEED
+
+    В отличие от hash() не зависит от PYTHONHASHSEED и не трогает
+    глобальный random, поэтому мир одинаков после перезапуска и
+    генерацию можно вызывать из любых потоков.
+    """
+    return _mix64((x * 0x9E3779B97F4A7C15 ^ y * 0xC2B2AE3D27D4EB4F
+                   ^ z * 0x165667B19E3779F9 ^ salt * 0xD6E8FEB86659FD93
+                   ^ _SEED_HASH) & MASK64)
+
+
+def coord_random(x, y, z=0, salt=0):
+    """Детерминированное число из [0, 1) для координат"""
+    return (coord_hash(x, y, z, salt) >> 11) * (1.0 / (1 << 53))
+
+
+@lru_cache(maxsize=DECORATION_CACHE_SIZE)
+def column_decoration(x, y):
+    """Украшения столбца (x, y): (дерево, гриб)
+
+    Считается по требованию из хеша координат, поэтому не нужно
+    заранее обходить области и хранить позиции всех деревьев.
+    """
+    return (coord_random(x, y, salt=SALT_TREE) < 0.3,  # Деревья (30%)
+            coord_random(x, y, salt=SALT_MUSHROOM) < 0.2)  # Грибы (20%)
+
 
 class WorldGenerator:
-    def __init__(self, items_file="items.json"):
-        with open(items_file, 'r', encoding='utf-8') as f:
-            self.items_data = json.load(f)
-        
-        self.tree_positions = {}
-        self.mushroom_positions = {}
+    """Генератор мира"""
+    
+    def __init__(self, cache_size=TERRAIN_CACHE_SIZE):
+        # items.json читается один раз общей палитрой
+        self.blocks = get_registry()
+        self.items_data = self.blocks.items_data
         
-    def _get_seed(self, x, y, z=0):
-        """Сид для координат"""
-        return hash(f"{x}_{y}_{z}_{WORLD_SEED}") % 1000000
+        # LRU-кэш сгенерированных плиток: (chunk_x, chunk_y, z): bytes ID
+        # размером CHUNK_SIZE×CHUNK_SIZE (строки по y)
+        self.cache_size = cache_size
+        self._tiles = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_evictions = 0
+    
+    def _uniform_id(self, z):
+        """ID блока, если слой z одинаков везде (трава, земля, воздух выше деревьев)"""
+        if z == AIR_HEIGHT or AIR_HEIGHT - GRASS_HEIGHT < z < AIR_HEIGHT or z > AIR_HEIGHT + 4:
+            return self.blocks.id_of(self._generate_block(0, 0, z))
+        return None
     
-    def generate_terrain(self, x, y, z):
-        """Генерация блока на позиции"""
-        # Проверяем ручную замену
-        key = f"{x},{y},{z}"
+    def _get_tile(self, chunk_x, chunk_y, z):
+        """Плитка генерации из кэша (или сгенерировать и запомнить)"""
+        key = (chunk_x, chunk_y, z)
+        tile = self._tiles.get(key)
+        if tile is not None:
+            self.cache_hits += 1
+            self._tiles.move_to_end(key)
+            return tile
         
-        # СЛОЙ 1: ВОЗДУХ
+        self.cache_misses += 1
+        x0, y0 = chunk_x << SHIFT, chunk_y << SHIFT
+        id_of = self.blocks.id_of
+        tile = bytes(id_of(self._generate_block(x, y, z))
+                     for y in range(y0, y0 + CHUNK_SIZE)
+                     for x in range(x0, x0 + CHUNK_SIZE))
+        
+        self._tiles[key] = tile
+        if len(self._tiles) > self.cache_size:
+            self._tiles.popitem(last=False)
+            self.cache_evictions += 1
+        return tile
+    
+    def cache_stats(self):
+        """Счётчики кэша генерации"""
+        return {
+            'hits': self.cache_hits,
+            'misses': self.cache_misses,
+            'evictions': self.cache_evictions,
+            'size': len(self._tiles),
+            'capacity': self.cache_size
+        }
+    
+    def get_block_id(self, x, y, z):
+        """ID сгенерированного блока на позиции"""
+        uniform = self._uniform_id(z)
+        if uniform is not None:
+            return uniform
+        tile = self._get_tile(x >> SHIFT, y >> SHIFT, z)
+        return tile[(y & MASK) << SHIFT | (x & MASK)]
+    
+    def get_block_type(self, x, y, z):
+        """Определить тип блока на позиции"""
+        return self.blocks.names[self.get_block_id(x, y, z)]
+    
+    def _generate_block(self, x, y, z):
+        """Сгенерировать блок на позиции (без кэша)"""
+        # ВОЗДУХ (верхние AIR_HEIGHT блоков)
         if z > AIR_HEIGHT:
-            tree_key = f"{x},{y}"
+            if z > AIR_HEIGHT + 4:  # Выше деревьев
+                return "воздух"
+            
+            has_tree, has_mushroom = column_decoration(x, y)
             
             # ДЕРЕВЬЯ
-            if tree_key in self.tree_positions:
-                if z == AIR_HEIGHT + 1:
+            if has_tree:
+                if z == AIR_HEIGHT + 1:  # Нижняя листва
                     return "листва"
-                elif z == AIR_HEIGHT + 2 or z == AIR_HEIGHT + 3:
+                elif z == AIR_HEIGHT + 2 or z == AIR_HEIGHT + 3:  # Ствол
                     return "ствол"
-                elif z == AIR_HEIGHT + 4:
+                elif z == AIR_HEIGHT + 4:  # Верхняя листва
                     return "листва"
             
             # ГРИБЫ
-            if z == AIR_HEIGHT + 1 and tree_key in self.mushroom_positions:
+            if z == AIR_HEIGHT + 1 and has_mushroom:
                 return "гриб поганка"
             
             return "воздух"
         
-        # СЛОЙ 2: ТРАВА
+        # ТРАВА (ровно на высоте AIR_HEIGHT)
         elif z == AIR_HEIGHT:
             return "трава"
         
-        # СЛОЙ 3: ЗЕМЛЯ
+        # ЗЕМЛЯ (GRASS_HEIGHT блоков под травой)
         elif AIR_HEIGHT - GRASS_HEIGHT < z < AIR_HEIGHT:
             return "земля"
         
-        # СЛОЙ 4: КАМЕНЬ и РУДЫ
+        # КАМЕНЬ и РУДЫ (ниже)
         else:
             depth = AIR_HEIGHT - z - GRASS_HEIGHT
+            rand_val = coord_random(x, y, z, SALT_ORE)
             
-            seed = self._get_seed(x * 1000 + y, z)
-            random.seed(seed)
-            rand_val = random.random()
-            
-            if depth >= 25 and depth <= 30:
+            # Руды по глубине
+            if depth >= 25 and depth <= 30:  # Алмазы
                 if rand_val < 0.05:
                     return "алмазная руда"
             
-            if depth >= 15 and depth <= 25:
+            if depth >= 15 and depth <= 25:  # Золото
                 if rand_val < 0.07:
                     return "золотая руда"
             
-            if depth >= 8 and depth <= 15:
+            if depth >= 8 and depth <= 15:  # Железо
                 if rand_val < 0.1:
                     return "железная руда"
             
-            if depth >= 3 and depth <= 15:
+            if depth >= 3 and depth <= 15:  # Уголь (чаще)
                 if rand_val < 0.15:
                     return "уголь"
             
+            # Камень (основной блок)
             return "камень"
     
-    def generate_area(self, center_x, center_y, radius=20):
-        """Генерация области"""
-        for x in range(center_x - radius, center_x + radius + 1):
-            for y in range(center_y - radius, center_y + radius + 1):
-                seed = self._get_seed(x, y)
-                random.seed(seed)
-                
-                tree_key = f"{x},{y}"
-                if random.random() < 0.3:
-                    self.tree_positions[tree_key] = True
-                
-                if random.random() < 0.2:
-                    self.mushroom_positions[tree_key] = True
-    
-    def get_block_data(self, block_type):
-        """Получить данные блока"""
-        return self.items_data["блоки"].get(block_type, {})
+    def get_layer(self, x0, y0, width, height, z):
+        """Срез генерации на высоте z: height строк по width ID блоков"""
+        uniform = self._uniform_id(z)
+        if uniform is not None:
+            row = bytes([uniform]) * width
+            return [bytearray(row) for _ in range(height)]
+        
+        # Строка среза склеивается из кусков строк закэшированных плиток
+        rows = []
+        for y in range(y0, y0 + height):
+            row = bytearray()
+            offset = (y & MASK) << SHIFT
+            x = x0
+            while x < x0 + width:
+                end = min(x0 + width, ((x >> SHIFT) + 1) << SHIFT)
+                tile = self._get_tile(x >> SHIFT, y >> SHIFT, z)
+                row += tile[offset + (x & MASK):offset + ((end - 1) & MASK) + 1]
+                x = end
+            rows.append(row)
+        return rows